@@ -1,18 +1,32 @@
 import argparse
 import pandas as pd
 import os
-import cv2
 from pathlib import Path
-import uuid  # For generating unique segment IDs
 from tqdm import tqdm
 import time
-from augment import has_visor, load_annotations, find_nearest_annotations, overlay_mask, apply_occlusion, noun_class_colors
+from augment import list_visor_videos, load_annotations, compile_annotations, VISOR_ANNOTATIONS_ROOT, COMPILED_ANNOTATIONS_ROOT
+from mask_cache import OcclusionMaskCache
 from decord import VideoReader, cpu
-import math
-from moviepy.editor import ImageSequenceClip
+from progress import ProgressJournal, shard_progress_path, find_shard_progress_paths, merge_progress, write_progress_csv
+from quality_score import harmonic_mean_score
+from plan_io import write_plan, read_plan, plan_rows, parse_augment_params, shard_plan, PlanRow
+from video_io import StreamingVideoWriter, iter_frame_windows, prefetch
+from work_queue import LeaseQueue
+from instrumentation import StageTimer, STAGES, segment_timings, summarize_timings, stage_histograms
+from memory import MemoryTracker, MemoryModel, probe_frame_size
+from photometric import DEFAULT_DARKEN_GAMMA
+from degradations import DEFAULT_BLUR_LENGTH, DEFAULT_BLUR_ANGLE, DEFAULT_SHAKE_AMPLITUDE, DEFAULT_SHAKE_ROTATION, DEFAULT_NOISE_SIGMA
+from operators import get_operator, OperatorContext, union_frame_indices, select_needed_frames, composite_types, COMPOSITE_SEPARATOR
+from cost_estimate import probe_clips, ThroughputModel, estimate_plan_cost, wall_clock_seconds, format_duration
+import tempfile
+import shutil
+import tracemalloc
+import cProfile
+import pstats
+import glob
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
-import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import zlib
 
 def frame_count_to_time_format(frame_count, fps=60):
     # Calculate total seconds from frame count
@@ -31,185 +45,183 @@ def frame_count_to_time_format(frame_count, fps=60):
     
     return time_formatted
 
+def frame_counts_to_time_format(frame_counts, fps=60):
+    # Vectorized `frame_count_to_time_format` for a whole column of frame counts
+    total_seconds = np.asarray(frame_counts) / fps
+
+    hours = (total_seconds // 3600).astype(np.int64)
+    minutes = ((total_seconds % 3600) // 60).astype(np.int64)
+    seconds = (total_seconds % 60).astype(np.int64)
+    milliseconds = ((total_seconds - total_seconds.astype(np.int64)) * 1000).astype(np.int64)
+
+    def pad(values, width):
+        return pd.Series(values).astype(str).str.zfill(width)
+
+    return (pad(hours, 2) + ':' + pad(minutes, 2) + ':' + pad(seconds, 2) + '.' + pad(milliseconds, 3)).to_numpy()
+
 def get_frame_count(row):
+    # Works on a single row as well as on a whole DataFrame
     return (row['stop_frame'] - row['start_frame'])
 
-def generate_augmentation_plan(csv_path, original_root, plan_csv_path, augmented_segments_csv_path):
+# Quality dimensions degraded by each augmentation, set in the augmented segments CSV.
+# Composite augmentations degrade the dimensions of every operator they apply.
+# action_presence,camera_motion,lighting,focus,action_completeness,object_presence
+QUALITY_EFFECTS = {
+    'occlusion': {'object_presence': 1},
+    'completeness': {'action_completeness': 1},
+    'darken': {'lighting': 1},
+    'motion_blur': {'focus': 1},
+    'camera_shake': {'camera_motion': 1},
+    'sensor_noise': {'focus': 1},
+}
+
+# Augmentations that are only planned when requested with `extra_augmentations`, for every row
+EXTRA_AUGMENTATIONS = ['motion_blur', 'camera_shake', 'sensor_noise']
+
+# Source clips {narration_id}.mp4, relative to the working directory unless --clips-root is given
+CLIPS_ROOT = '../../processed_videos/clipped_resized_videos'
+
+def generate_augmentation_plan(csv_path, original_root, plan_csv_path, augmented_segments_csv_path, negative_samples_count=1, seed=None, darken_gamma=DEFAULT_DARKEN_GAMMA, composites=None, extra_augmentations=None, annotations_root=None, compiled_root=None):
     # Load the original CSV
     data = pd.read_csv(csv_path)
 
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(plan_csv_path), exist_ok=True)
 
-    # Initialize a list to store augmentation plans
-    plan_data = []
-    new_rows_data = []
-
-    # Function to generate a unique segment ID
-    def generate_segment_id(narration_id):
-        return f"{narration_id}_{uuid.uuid4().hex}"
-
-    # Customizable strategy function
-    def should_augment(row):
-        # Define your strategy here; for example:
-        # if row['verb_class'] in [0, 1, 2]:  # Example condition
-        
-        augmentations = [{'type': 'darken'}]
-        
-        if get_frame_count(row) > 120:
-            augmentations.append({ 'type': 'completeness', 'params': {'level': 0.5} })
-        if has_visor(row['video_id']):
-            augmentations.append({ 'type': 'occlusion'})
-
-        return True, augmentations # Return the augmentations to apply
-        # return True, [{ 'type': 'occlusion'}]
-
-    max_i = {}
-    # Iterate through the original dataset
-    for idx, row in data.iterrows():
-        narration_id = row['narration_id']
-        participant_id = row['participant_id']
-        video_id = row['video_id']
-        start_frame = row['start_frame']
-        stop_frame = row['stop_frame']
-        action_label = row['narration']  # Original action label
-
-        # Determine whether to augment this segment and which augmentations to apply
-        augment, augmentations = should_augment(row)
-
-        if not augment:
-            continue
-
-        # Generate a unique segment ID
-        # segment_id = generate_segment_id(narration_id)
-
-        max_i[narration_id] = 0
-        for i, augmentation in enumerate(augmentations):
-            augment_type = augmentation['type']
-            augment_params = augmentation.get('params', {})
-            new_row = row.copy()
-            segment_id =  narration_id + "_" + str(max_i[narration_id])
-            max_i[narration_id] += 1
-            
-            new_row['narration_id'] = segment_id
-            new_row['video_id'] = segment_id
-            
-            frame_count = get_frame_count(row)
-            new_row['narration_timestamp'] = '00:00:00.000'
-            new_row['start_timestamp'] = '00:00:00.000'
-            new_row['start_frame'] = 1
-            new_row['stop_frame'] = frame_count
-            new_row['stop_timestamp'] = frame_count_to_time_format(frame_count)
-            
-# action_presence,camera_motion,lighting,focus,action_completeness,object_presence
-            if augment_type == 'occlusion':
-                new_row['object_presence'] = 1
-            elif augment_type == 'completeness':
-                frame_count = min(frame_count // 2, 60 * 3)
-                new_row['action_completeness'] = 1
-                new_row['stop_frame'] = frame_count
-                new_row['stop_timestamp'] = frame_count_to_time_format(frame_count)
-
-                augment_params['frame_count'] = frame_count
-
-            elif augment_type == 'darken':
-                new_row['lighting'] = 1
-                
-
-            # Example: Set augmentation-specific parameters
-
-            # Record the augmentation plan
-            plan_row = {
-                'segment_id': segment_id,
-                'narration_id': narration_id,
-                'participant_id': participant_id,
-                'video_id': video_id,
-                'start_frame': start_frame,
-                'stop_frame': stop_frame,
-                'narration': action_label,
-                'augment_type': augment_type,
-                'augment_params': augment_params,
-                # 'original_frame_dir': os.path.join(original_root, participant_id, video_id)
-            }
-            
-            
-            new_rows_data.append(new_row)
-            plan_data.append(plan_row)
-
-    negatives = add_negatives(data)
-    
-    for index, row in negatives.iterrows():
-        narration_id = row['narration_id']
-        participant_id = row['participant_id']
-        video_id = row['video_id']
-        start_frame = row['start_frame']
-        stop_frame = row['stop_frame']
-        action_label = row['narration']
-
-        segment_id =  row['narration_id'] + "_" + str(max_i[narration_id])
-        max_i[narration_id] += 1
-        
-        # Update narration id for uniqueness
-        row['narration_id'] = segment_id
-        
-        plan_row = {
-            'segment_id': segment_id,
-            'narration_id': narration_id,
-            'participant_id': participant_id,
-            'video_id': video_id,
-            'start_frame': start_frame,
-            'stop_frame': stop_frame,
-            'narration': action_label,
-            'augment_type': 'negative',
-            # The source of the annotation values is negative_narration_id
-            'augment_params': {'negative_narration_id': row['negative_narration_id']},
-        }
-        plan_data.append(plan_row)
-        new_rows_data.append(row)
-    
-    # Save the augmentation plan CSV
-    plan_df = pd.DataFrame(plan_data)
-    plan_df.to_csv(plan_csv_path, index=False)
-    new_rows_df = pd.DataFrame(new_rows_data)
-    new_rows_df = new_rows_df.drop('negative_narration_id', axis=1)
-
-    
-    
-    # Define a function to calculate the quality score
-    def calculate_quality_score(row):
-        if row['action_presence'] == 0:
-            return 0.0  # If action_presence is 0, the quality_score is 0
-
-        quality_dimensions = ['camera_motion', 'lighting', 'focus', 'action_completeness', 'object_presence']
-
-        # Avoid division by zero in case all quality dimensions are zero
-        sum_of_inverses = sum(1.0 / row[dim] for dim in quality_dimensions if row[dim] != 0)
-        
-        if sum_of_inverses == 0:
-            return 0.0  # If all dimensions are zero, return zero score
-
-        # Calculate the harmonic mean of the quality dimensions
-        harmonic_mean = len(quality_dimensions) / sum_of_inverses
-        
-        # Define the min and max values for the harmonic mean
-        HM_min = 1  # The harmonic mean is at least 1 when all dimensions are equal to 1
-        HM_max = 5  # The harmonic mean is at most 5 when all dimensions are equal to 5
-
-        # Normalize the harmonic mean to a value between 0 and 1
-        normalized_score = (harmonic_mean - HM_min) / (HM_max - HM_min)
-        
-        return normalized_score
-
-        # Sum the weighted quality dimensions, assume equal weights for simplicity
-        p = 1
-        score = sum(row[dim] ** p for dim in quality_dimensions) / (len(quality_dimensions) ** (p + 1))
-        return score
-    
-
-    new_rows_df = pd.concat([data, new_rows_df])
+    frame_counts = get_frame_count(data)
+
+    # Customizable strategy: which rows each augmentation applies to, in the order they are applied
+    def should_augment(data):
+        # List the VISOR directory once instead of checking for a file per row
+        visor_videos = list_visor_videos(annotations_root, compiled_root)
+
+        strategy = [
+            ('darken', pd.Series(True, index=data.index)),
+            ('completeness', frame_counts > 120),
+            ('occlusion', data['video_id'].isin(visor_videos)),
+        ]
+        for augment_type in extra_augmentations or []:
+            if augment_type not in EXTRA_AUGMENTATIONS:
+                raise ValueError(f"Unknown augmentation {augment_type}, expected one of {', '.join(EXTRA_AUGMENTATIONS)}")
+            strategy.append((augment_type, pd.Series(True, index=data.index)))
+
+        # Composites, e.g. 'darken+occlusion', apply to rows that every one of their operators applies to
+        masks = {**{augment_type: pd.Series(True, index=data.index) for augment_type in EXTRA_AUGMENTATIONS}, **dict(strategy)}
+        for composite in composites or []:
+            unknown = [augment_type for augment_type in composite_types(composite) if augment_type not in masks]
+            if unknown:
+                raise ValueError(f"Unknown augmentation {', '.join(unknown)} in composite {composite}")
+            strategy.append((composite, pd.concat([masks[augment_type] for augment_type in composite_types(composite)], axis=1).all(axis=1)))
+
+        return strategy
+
+    # Stack the rows of every augmentation and order them by source row, then augmentation
+    augmented = pd.concat([
+        data[mask].assign(_source=np.flatnonzero(mask.to_numpy()), _order=order, augment_type=augment_type)
+        for order, (augment_type, mask) in enumerate(should_augment(data))
+    ])
+    augmented = augmented.sort_values(['_source', '_order'], kind='stable').reset_index(drop=True)
+
+    # Segment ids are numbered per source row: {narration_id}_0, {narration_id}_1, ...
+    augment_index = augmented.groupby('_source').cumcount()
+    segment_ids = augmented['narration_id'] + "_" + augment_index.astype(str)
+    augment_types = augmented['augment_type'].to_numpy()
+
+    # The augmentations applied by every row, more than one for composites
+    applied_types = {augment_type: set(composite_types(augment_type)) for augment_type in np.unique(augment_types)}
+    def applies(augment_type):
+        return np.array([augment_type in applied_types[row_type] for row_type in augment_types], dtype=bool)
+
+    is_completeness = applies('completeness')
+    segment_frame_counts = get_frame_count(augmented).to_numpy()
+    truncated_frame_counts = np.minimum(segment_frame_counts // 2, 60 * 3)
+
+    def params_for(augment_type, frame_count, segment_id):
+        if COMPOSITE_SEPARATOR in augment_type:
+            # The operators of a composite, in the order they are applied
+            return {'operators': [{'type': operator_type, 'params': params_for(operator_type, frame_count, segment_id)} for operator_type in composite_types(augment_type)]}
+        if augment_type == 'completeness':
+            return {'level': 0.5, 'frame_count': int(frame_count)}
+        if augment_type == 'darken':
+            return {'gamma': darken_gamma}
+        # Random augmentations are seeded by segment, so re-rendering a segment gives the same frames
+        segment_seed = zlib.crc32(segment_id.encode())
+        if augment_type == 'motion_blur':
+            return {'length': DEFAULT_BLUR_LENGTH, 'angle': DEFAULT_BLUR_ANGLE}
+        if augment_type == 'camera_shake':
+            return {'amplitude': DEFAULT_SHAKE_AMPLITUDE, 'rotation': DEFAULT_SHAKE_ROTATION, 'seed': segment_seed}
+        if augment_type == 'sensor_noise':
+            return {'sigma': DEFAULT_NOISE_SIGMA, 'seed': segment_seed}
+        return {}
+
+    augment_params = [
+        params_for(augment_type, frame_count, segment_id)
+        for augment_type, frame_count, segment_id in zip(augment_types, truncated_frame_counts, segment_ids)
+    ]
+
+    # Record the augmentation plan
+    plan_df = pd.DataFrame({
+        'segment_id': segment_ids.to_numpy(),
+        'narration_id': augmented['narration_id'].to_numpy(),
+        'participant_id': augmented['participant_id'].to_numpy(),
+        'video_id': augmented['video_id'].to_numpy(),
+        'start_frame': augmented['start_frame'].to_numpy(),
+        'stop_frame': augmented['stop_frame'].to_numpy(),
+        'narration': augmented['narration'].to_numpy(),
+        'augment_type': augment_types,
+        'augment_params': augment_params,
+    })
+
+    new_rows_df = augmented.drop(columns=['_source', '_order', 'augment_type'])
+    new_rows_df['narration_id'] = segment_ids
+    new_rows_df['video_id'] = segment_ids
+    new_rows_df['narration_timestamp'] = '00:00:00.000'
+    new_rows_df['start_timestamp'] = '00:00:00.000'
+    new_rows_df['start_frame'] = 1
+    new_rows_df['stop_frame'] = np.where(is_completeness, truncated_frame_counts, segment_frame_counts)
+    new_rows_df['stop_timestamp'] = frame_counts_to_time_format(new_rows_df['stop_frame'])
+
+    for augment_type, effects in QUALITY_EFFECTS.items():
+        applied = applies(augment_type)
+        for dimension, value in effects.items():
+            new_rows_df.loc[applied, dimension] = value
+
+    negatives = add_negatives(data, negative_samples_count, seed).reset_index(drop=True)
+
+    # Negatives continue the numbering after the augmentations of their narration
+    augmentation_counts = augment_index.groupby(augmented['_source']).size()
+    next_index = (
+        pd.Series(augmentation_counts.reindex(range(len(data)), fill_value=0).to_numpy(), index=data['narration_id'])
+        .groupby(level=0).last()
+    )
+    negative_index = next_index.reindex(negatives['narration_id']).to_numpy() + negatives.groupby('narration_id').cumcount().to_numpy()
+    negative_segment_ids = negatives['narration_id'] + "_" + pd.Series(negative_index).astype(str)
+
+    negative_plan_df = pd.DataFrame({
+        'segment_id': negative_segment_ids.to_numpy(),
+        'narration_id': negatives['narration_id'].to_numpy(),
+        'participant_id': negatives['participant_id'].to_numpy(),
+        'video_id': negatives['video_id'].to_numpy(),
+        'start_frame': negatives['start_frame'].to_numpy(),
+        'stop_frame': negatives['stop_frame'].to_numpy(),
+        'narration': negatives['narration'].to_numpy(),
+        'augment_type': 'negative',
+        # The source of the annotation values is negative_narration_id
+        'augment_params': [{'negative_narration_id': narration_id} for narration_id in negatives['negative_narration_id']],
+    })
+
+    # Update narration id for uniqueness
+    negative_rows_df = negatives.drop('negative_narration_id', axis=1)
+    negative_rows_df['narration_id'] = negative_segment_ids
+
+    # Save the augmentation plan, typed Parquet or CSV depending on the extension
+    plan_df = pd.concat([plan_df, negative_plan_df], ignore_index=True)
+    write_plan(plan_df, plan_csv_path)
+
+    new_rows_df = pd.concat([data, new_rows_df, negative_rows_df])
 
     # Calculate the quality score for each row in the quality data
-    new_rows_df['quality_score'] = new_rows_df.apply(calculate_quality_score, axis=1)
+    new_rows_df['quality_score'] = harmonic_mean_score(new_rows_df)
     
     new_rows_df.to_csv(augmented_segments_csv_path, index=False)
 
@@ -217,252 +229,733 @@ def generate_augmentation_plan(csv_path, original_root, plan_csv_path, augmented
     print(f"Augmented segments saved to {augmented_segments_csv_path}")
 
 
-def add_negatives(df, negative_samples_count = 1):
-    combined_group = df.groupby(['noun_class', 'verb_class'])
-    # verb_group = df.groupby('verb_class')
-    # noun_group = df.groupby('noun_class')
-    
-    # Initialize a cache dictionary
-    cache = {}
-
-    augmented_df = pd.DataFrame()
-    # Step 2: Define a function to filter and cache the result
-    def filter_and_cache(row, combined_group, cache):
-        key = (row['noun_class'], row['verb_class'])
-        
-        # If the result is already cached, return it
-        if key in cache:
-            return cache[key]
-        
-        # Otherwise, filter the group and store it in the cache
-        filtered_df = combined_group.filter(lambda x: x.name[0] != row['noun_class'] or x.name[1] != row['verb_class'])
-        
-        cache[key] = filtered_df
-        return filtered_df
-    
-    for index, row in df.iterrows():
-        # Sample n items from the filtered dataframe
-        sampled_items = filter_and_cache(row, combined_group, cache).sample(n=negative_samples_count, random_state=np.random.RandomState())
-        
-        # Set quality_score to 0
-        sampled_items['quality_score'] = 0
-        sampled_items['action_presence'] = 0
-        
-        # Change noun_class and verb_class to match the parent record
-        sampled_items['noun_class'] = row['noun_class']
-        sampled_items['verb_class'] = row['verb_class']
-        sampled_items['negative_narration_id'] = sampled_items['narration_id']
-        sampled_items['narration_id'] = row['narration_id']
-        
-        augmented_df = pd.concat([augmented_df, sampled_items])
-        
-    return augmented_df
+def add_negatives(df, negative_samples_count = 1, seed=None):
+    """
+    Samples negative examples: for every row, `negative_samples_count` distinct rows
+    from outside its (noun_class, verb_class) group, relabelled with the row's classes.
+    """
+    rng = np.random.default_rng(seed)
+    n = negative_samples_count
+
+    # Group of every row; rows with a missing class belong to no group
+    group_codes = df.groupby(['noun_class', 'verb_class'], sort=False).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    in_group = group_codes >= 0
+
+    # Order the candidate rows by group, so the rows outside a group are the
+    # positions before its start and after its end
+    candidates = np.flatnonzero(in_group)[np.argsort(group_codes[in_group], kind='stable')]
+    group_sizes = np.bincount(group_codes[in_group], minlength=1)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+
+    own_codes = np.where(in_group, group_codes, 0)
+    own_start = np.where(in_group, group_starts[own_codes], 0)
+    own_size = np.where(in_group, group_sizes[own_codes], 0)
+    population = len(candidates) - own_size
+
+    if (population < n).any():
+        raise ValueError("Cannot take a larger sample than population when 'replace=False'")
+
+    # Floyd's algorithm, vectorized over rows: n distinct positions in [0, population)
+    picks = np.empty((len(df), n), dtype=np.int64)
+    for k in range(n):
+        upper = population - n + k
+        t = rng.integers(0, upper + 1)
+        if k > 0:
+            t = np.where((picks[:, :k] == t[:, None]).any(axis=1), upper, t)
+        picks[:, k] = t
+
+    # Skip over each row's own group to map the positions onto the candidates
+    picks = np.where(picks >= own_start[:, None], picks + own_size[:, None], picks)
+    parents = np.repeat(np.arange(len(df)), n)
+
+    sampled_items = df.iloc[candidates[picks.ravel()]].copy()
+
+    # Set quality_score to 0
+    sampled_items['quality_score'] = 0
+    sampled_items['action_presence'] = 0
+
+    # Change noun_class and verb_class to match the parent record
+    sampled_items['noun_class'] = df['noun_class'].to_numpy()[parents]
+    sampled_items['verb_class'] = df['verb_class'].to_numpy()[parents]
+    sampled_items['negative_narration_id'] = sampled_items['narration_id'].to_numpy()
+    sampled_items['narration_id'] = df['narration_id'].to_numpy()[parents]
+
+    return sampled_items
 
 
 global annotations 
 annotations = None
-# Function to apply augmentations
-def apply_augmentations(row, frame, frame_index, total_frames, frame_num, augment_type, params=None):
-    global annotations 
-    global noun_class_colors
-    if augment_type == 'occlusion':
-        # Apply occlusion logic (e.g., mask parts of the image)
-        if annotations is None or annotations['video_id'] != row['video_id']:
-            # TODO: add a flag for the root path ?
-            annotations = {
-                'video_id': row['video_id'],
-                'annotations': load_annotations(row['video_id']),
-            }
-
-        frame_annotations = find_nearest_annotations(frame_num, annotations['annotations'])
-        
-        return apply_occlusion(frame, frame_annotations, noun_class_colors)
-    elif augment_type == 'completeness':
-        if frame_index > params['frame_count']:
-            return None
-        return frame
-        # Apply action completeness logic (e.g., crop frames based on params)
-        # pass
-    elif augment_type == 'darken':
-        # darker_frame = (frame * 0.3).astype(np.uint8)
-        # return darker_frame
-        
-        gamma = 4.0
-        normalized_frame = frame / 255.0
-        # Apply gamma correction
-        gamma_corrected_frame = np.power(normalized_frame, gamma)
-        # Rescale back to [0, 255]
-        darker_frame = (gamma_corrected_frame * 255).astype(np.uint8)
-        return darker_frame
-    elif augment_type == 'object_presence':
-        # Apply object presence logic (e.g., blur specific objects)
-        pass
-    return frame
-
-    
-def process_augmentation_plan(plan_csv_path, augmented_root, progress_csv_path):
-    # Load the augmentation plan
-    plan_data = pd.read_csv(plan_csv_path)
 
-    # Check if a progress CSV already exists to resume from where it left off
-    if os.path.exists(progress_csv_path):
-        progress_data = pd.read_csv(progress_csv_path)
+# Rasterized occlusion masks, replaced in each pool worker by `init_worker`
+global occlusion_masks
+occlusion_masks = OcclusionMaskCache()
+
+# cProfile profiler of this worker when running with --profile
+global worker_profiler
+worker_profiler = None
+
+# VISOR JSON and compiled index directories of this worker, set by `init_worker`
+# (None uses the defaults of the `augment` module)
+global annotation_roots
+annotation_roots = (None, None)
+
+# Source clip directory of this worker, set by `init_worker`
+global clips_root
+clips_root = CLIPS_ROOT
+
+def init_worker(mask_cache_mb=256, mask_cache_dir=None, profile_dir=None, trace_allocations=False, annotations_root=None, compiled_root=None, source_clips_root=None):
+    global occlusion_masks, worker_profiler, annotation_roots, clips_root
+    occlusion_masks = OcclusionMaskCache(max_bytes=mask_cache_mb * 1024 * 1024, spill_dir=mask_cache_dir)
+    annotation_roots = (annotations_root, compiled_root)
+    clips_root = source_clips_root or CLIPS_ROOT
+
+    if trace_allocations:
+        # Recorded per clip by `MemoryTracker`, at the cost of slower allocations
+        tracemalloc.start()
+
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        worker_profiler = (cProfile.Profile(), os.path.join(profile_dir, f"worker-{os.getpid()}.prof"))
+        worker_profiler[0].enable()
+
+def dump_worker_profile():
+    # Dumped after every task, since pool workers exit without running atexit handlers
+    if worker_profiler is not None:
+        profiler, path = worker_profiler
+        profiler.dump_stats(path)
+        profiler.enable()
+
+# Lookups of the annotation cache in this process, see `cache_counters`
+global annotation_cache_stats
+annotation_cache_stats = {'hits': 0, 'misses': 0}
+
+def get_video_annotations(video_id):
+    global annotations
+    if annotations is None or annotations['video_id'] != video_id:
+        annotation_cache_stats['misses'] += 1
+        annotations = {
+            'video_id': video_id,
+            'annotations': load_annotations(video_id, *annotation_roots),
+        }
     else:
-        # Initialize the progress DataFrame if it doesn't exist
-        progress_data = pd.DataFrame(columns=plan_data.columns.tolist() + ['status'])
-
-    # Convert progress data to a dictionary for quick lookup
-    completed_segments = set(progress_data[progress_data['status'] == 'completed']['segment_id'])
+        annotation_cache_stats['hits'] += 1
+    return annotations['annotations']
+
+def cache_counters():
+    return {
+        'annotation_hits': annotation_cache_stats['hits'],
+        'annotation_misses': annotation_cache_stats['misses'],
+        'mask_hits': occlusion_masks.hits,
+        'mask_misses': occlusion_masks.misses,
+    }
+
+def operator_context():
+    # Built on every call, since `init_worker` replaces the mask cache
+    return OperatorContext(annotations=get_video_annotations, masks=occlusion_masks)
+
+def resolve_worker_count(workers=None, memory_budget_mb=None, worker_memory_mb=1024):
+    """
+    Returns the number of worker processes allowed by the CPU and memory budgets.
+
+    Args:
+        workers (int): Maximum number of workers, defaults to the number of CPUs.
+        memory_budget_mb (int): Optional memory (MB) available to all workers together.
+        worker_memory_mb (int): Expected peak memory (MB) of one worker.
+    """
+    workers = workers or os.cpu_count() or 1
+    if memory_budget_mb is not None:
+        workers = min(workers, max(1, memory_budget_mb // worker_memory_mb))
+    return workers
+
+def process_augmentation_plan(plan_csv_path, augmented_root, progress_csv_path, mask_cache_mb=256, mask_cache_dir=None, schedule='video', encoder_options=None, window_size=64, batch_size=None, num_shards=1, shard_index=0, queue_path=None, lease_seconds=300, workers=None, profile_dir=None, memory_budget_mb=None, trace_allocations=False, annotations_root=None, compiled_root=None, source_clips_root=None):
+    # Load the augmentation plan, with augment_params already parsed
+    plan_data = read_plan(plan_csv_path)
+    plan_columns = plan_data.columns.tolist()
+    workers = workers or resolve_worker_count()
+
+    if queue_path is not None:
+        # Every run queues the whole plan split the same way, so all hosts derive the same
+        # task ids; the queue, not the local progress, records which tasks are done
+        os.makedirs(augmented_root, exist_ok=True)
+        tasks = schedule_tasks(plan_rows(plan_data), schedule)
+        del plan_data
+        process_plan_with_queue(queue_path, tasks, schedule, progress_csv_path, plan_columns, augmented_root, mask_cache_mb, mask_cache_dir, encoder_options, window_size, lease_seconds, workers, profile_dir, trace_allocations, annotations_root, compiled_root, source_clips_root)
+        return
+
+    if num_shards > 1:
+        # Each host processes its own shard and keeps its own progress, merged later with merge-progress
+        plan_data = shard_plan(plan_data, num_shards, shard_index)
+        journal = ProgressJournal(shard_progress_path(progress_csv_path, shard_index, num_shards))
+        # Segments recorded by an earlier merge are done as well
+        completed_segments = journal.completed_segments() | ProgressJournal(progress_csv_path).completed_segments()
+        print(f"Processing shard {shard_index} of {num_shards}: {len(plan_data)} plan rows")
+    else:
+        # Resume from the progress CSV and any journal left behind by an interrupted run
+        journal = ProgressJournal(progress_csv_path)
+        completed_segments = journal.completed_segments()
 
     # Ensure the output directory exists
     os.makedirs(augmented_root, exist_ok=True)
 
-    with ProcessPoolExecutor() as executor:
-        futures = {
-            executor.submit(process_segment, augmented_root, row): row
-            for idx, row in plan_data.iterrows() if row['segment_id'] not in completed_segments
-        }
-        
-            # Iterate through the augmentation plan with segment-level progress tracking
-        # for idx, row in tqdm(plan_data.iterrows(), total=len(plan_data), desc="Processing Segments"):
+    # Rows are kept and sent to workers as compact tuples instead of pandas Series
+    pending_rows = plan_rows(plan_data[~plan_data['segment_id'].isin(completed_segments)])
+    del plan_data
 
-        with tqdm(total=len(futures), desc="Processing Segments") as pbar:
-            # Use tqdm to track progress
-            for future in as_completed(futures):
-                try:
-                    row = future.result(timeout=1*60)
-                    # Mark as completed and add to progress tracking
-                    row['status'] = 'completed'
-                    progress_data = pd.concat([progress_data, pd.DataFrame([row])], ignore_index=True)
-
-                    # Save progress after each completed segment to avoid data loss
-                    progress_data.to_csv(progress_csv_path, index=False)
-                    completed_segments.add(row['segment_id'])
-                except Exception as e:
-                    print(f"Error processing video: {e}")
-                    raise e
-                
-                pbar.update(1)
+    tasks = schedule_tasks(pending_rows, schedule, batch_size)
+
+    try:
+        run_tasks(tasks, len(pending_rows), journal, augmented_root, mask_cache_mb, mask_cache_dir, encoder_options, window_size, workers, profile_dir=profile_dir, memory_budget_mb=memory_budget_mb, trace_allocations=trace_allocations, annotations_root=annotations_root, compiled_root=compiled_root, source_clips_root=source_clips_root)
+    finally:
+        # Fold the journal back into the progress CSV, also when the run is interrupted
+        journal.compact(plan_columns + ['status'])
 
+    print(f"Augmentation processing completed. Progress saved to {journal.progress_csv_path}")
 
+def report_progress(progress_csv_path, profile_dir=None, top=25):
+    """
+    Prints the throughput of every stage and per-stage timing histograms of a run.
+    """
+    progress_data = ProgressJournal(progress_csv_path).read_progress()
+    if progress_data.empty or 'frames' not in progress_data:
+        print(f"No stage timings recorded in {progress_csv_path}")
+    else:
+        stages, augment_types = summarize_timings(progress_data)
+        print(f"Stage throughput ({stages['frames'].max()} segment frames):")
+        print(stages.to_string(float_format=lambda value: f"{value:.2f}"))
+        print("\nAugment throughput per augment_type:")
+        print(augment_types.to_string(float_format=lambda value: f"{value:.2f}"))
+        print("\nSegments per bucket of milliseconds per frame:")
+        print(stage_histograms(progress_data).to_string())
+
+    if profile_dir is not None:
+        profiles = sorted(glob.glob(os.path.join(profile_dir, '*.prof')))
+        if not profiles:
+            print(f"No profiles found in {profile_dir}")
+            return
+        print(f"\nTop {top} functions by cumulative time across {len(profiles)} worker profiles:")
+        pstats.Stats(*profiles).sort_stats('cumulative').print_stats(top)
+
+def calibrate_with_sample(plan_data, sample_narrations, sample_dir=None, encoder_options=None, window_size=64, seed=None, annotations_root=None, compiled_root=None, source_clips_root=None):
+    """
+    Processes every plan row of a random sample of source clips, to calibrate the cost estimate.
+
+    Returns:
+        pd.DataFrame: The progress records of the sample run.
+    """
+    rendered = plan_data[plan_data['augment_type'] != 'negative']
+
+    # One clip of every augment_type first, so rare augmentations are calibrated too
+    sample = set(rendered.groupby('augment_type', observed=True)['narration_id'].apply(lambda ids: ids.sample(1, random_state=seed).iloc[0]))
+    remaining = rendered.loc[~rendered['narration_id'].isin(sample), 'narration_id'].drop_duplicates()
+    sample |= set(remaining.sample(min(max(sample_narrations - len(sample), 0), len(remaining)), random_state=seed))
+
+    work_dir = sample_dir or tempfile.mkdtemp(prefix='augment-estimate-')
+    try:
+        os.makedirs(work_dir, exist_ok=True)
+        sample_plan_path = os.path.join(work_dir, 'sample_plan.csv')
+        sample_progress_path = os.path.join(work_dir, 'sample_progress.csv')
+        write_plan(rendered[rendered['narration_id'].isin(sample)], sample_plan_path)
+
+        print(f"Calibrating on {len(sample)} source clips in {work_dir}")
+        # A single worker, so the timings are not inflated by other workers on the same CPUs
+        process_augmentation_plan(sample_plan_path, os.path.join(work_dir, 'generated'), sample_progress_path, encoder_options=encoder_options, window_size=window_size, workers=1, annotations_root=annotations_root, compiled_root=compiled_root, source_clips_root=source_clips_root)
+        return ProgressJournal(sample_progress_path).read_progress()
+    finally:
+        if sample_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def estimate_plan(plan_csv_path, calibration_progress_paths=None, worker_counts=(1,), progress_csv_path=None, sample_narrations=0, sample_dir=None, schedule='video', encoder_options=None, window_size=64, seed=None, annotations_root=None, compiled_root=None, source_clips_root=None):
+    """
+    Prints the expected CPU-hours, wall-clock time and output size of processing a plan.
+
+    Source clips are probed from their container headers without decoding. Stage
+    throughput per augment_type is calibrated from the progress of earlier runs
+    and/or from a sample run on `sample_narrations` clips of the plan, see `ThroughputModel`.
+    """
+    plan_data = read_plan(plan_csv_path)
+
+    calibration = [ProgressJournal(path).read_progress() for path in calibration_progress_paths or []]
+    if sample_narrations:
+        calibration.append(calibrate_with_sample(plan_data, sample_narrations, sample_dir, encoder_options, window_size, seed, annotations_root, compiled_root, source_clips_root))
+    model = ThroughputModel.from_progress(pd.concat(calibration, ignore_index=True))
+
+    if progress_csv_path is not None:
+        # Only the segments still to do, as process-plan would resume
+        plan_data = plan_data[~plan_data['segment_id'].isin(ProgressJournal(progress_csv_path).completed_segments())]
+        if plan_data.empty:
+            print(f"Every segment of the plan is completed in {progress_csv_path}")
+            return
+
+    # Probe each source clip once, negatives are not rendered
+    narration_ids = plan_data.loc[plan_data['augment_type'] != 'negative', 'narration_id'].astype(str).unique()
+    probes = probe_clips([narration_clip_path(narration_id, source_clips_root) for narration_id in tqdm(narration_ids, desc="Probing clips")])
+    clips = pd.DataFrame([probe or {} for probe in probes], index=pd.Index(narration_ids, name='narration_id'), columns=['frames', 'width', 'height', 'fps'])
+
+    missing = clips['frames'].isna()
+    if missing.any():
+        # Fall back to the plan's frame range and the most common frame size
+        print(f"Warning: {missing.sum()} of {len(clips)} source clips could not be probed, using the frame range of the plan")
+        plan_frames = plan_data.drop_duplicates(subset='narration_id').set_index('narration_id').eval('stop_frame - start_frame')
+        clips.loc[missing, 'frames'] = plan_frames.reindex(clips.index[missing]).to_numpy()
+        width, height = (clips.loc[~missing, ['width', 'height']].mode().iloc[0] if (~missing).any() else (576, 324))
+        clips.loc[missing, ['width', 'height']] = width, height
+
+    estimate = estimate_plan_cost(plan_data, clips, model)
+
+    uncalibrated = sorted(set(estimate['augment_type']) - set(model.samples) - {'negative'})
+    if uncalibrated:
+        print(f"Warning: no calibration samples for {', '.join(uncalibrated)}, costed from their operators or like an average augmentation")
+
+    summary = estimate.groupby('augment_type').agg(
+        segments=('segment_id', 'size'), frames_written=('frames_written', 'sum'), seconds=('seconds', 'sum'), bytes=('bytes', 'sum'),
+    )
+    summary['calibration_segments'] = [model.samples.get(augment_type, 0) for augment_type in summary.index]
+    summary['cpu_hours'] = summary['seconds'] / 3600
+    summary['output_gb'] = summary['bytes'] / 1e9
+
+    print(f"\nEstimate for {len(plan_data)} plan rows from {len(clips)} source clips ({int(clips['frames'].sum())} frames):")
+    print(summary.drop(columns=['seconds', 'bytes']).to_string(float_format=lambda value: f"{value:.3f}"))
+    print(f"\nCPU-hours: {estimate['seconds'].sum() / 3600:.3f} (decoding source clips: {estimate['decode_seconds'].sum() / 3600:.3f})")
+    print(f"Output size: {estimate['bytes'].sum() / 1e9:.3f} GB")
+    for workers in worker_counts:
+        print(f"Wall-clock time with {workers} workers: {format_duration(wall_clock_seconds(estimate, workers, schedule))}")
+
+def merge_shard_progress(progress_csv_path, num_shards=None):
+    if num_shards is None:
+        shard_paths = find_shard_progress_paths(progress_csv_path)
+    else:
+        shard_paths = [shard_progress_path(progress_csv_path, shard_index, num_shards) for shard_index in range(num_shards)]
+        missing = [path for path in shard_paths if not os.path.exists(path) and not os.path.exists(f"{path}.journal")]
+        if missing:
+            print(f"Warning: no progress found for {len(missing)} shards: {', '.join(missing)}")
+
+    progress_data = merge_progress(progress_csv_path, shard_paths)
+    completed = (progress_data['status'] == 'completed').sum() if not progress_data.empty else 0
+    print(f"Merged {len(shard_paths)} shard progress files into {progress_csv_path} ({completed} completed segments)")
+
+def schedule_tasks(rows, schedule='video', batch_size=None):
+    """
+    Splits the pending plan rows into the tasks handed to the worker pool.
+
+    Args:
+        rows (list): Pending `PlanRow`s.
+        schedule (str): 'segment' for one row per task, 'narration' for one task per
+                        source clip, or 'video' for one task per video, so each worker
+                        loads a video's annotations once and decodes each clip once.
+        batch_size (int): Optional maximum number of rows per video task. Videos are
+                          only split between narrations.
+
+    Returns:
+        list: Tasks, each a list of rows.
+    """
+    if schedule == 'segment':
+        return [[row] for row in rows]
+
+    # Every augmentation of a narration reuses the same source clip, so decode it once per group
+    narrations = {}
+    for row in rows:
+        narrations.setdefault((row.video_id, row.narration_id), []).append(row)
+
+    if schedule == 'narration':
+        return list(narrations.values())
+
+    videos = {}
+    for (video_id, _), group in narrations.items():
+        videos.setdefault(video_id, []).append(group)
+
+    tasks = []
+    for groups in videos.values():
+        batch = []
+        for group in groups:
+            if batch and batch_size and len(batch) + len(group) > batch_size:
+                tasks.append(batch)
+                batch = []
+            batch.extend(group)
+        tasks.append(batch)
+
+    # Start the largest videos first so they do not become the stragglers of the run
+    tasks.sort(key=len, reverse=True)
+    return tasks
+
+def queue_task_id(rows, schedule):
+    """
+    Identifies a queue task by its rows, so every run derives the same id: the
+    segment_id of a segment task, or `{video_id}/{narration_id}` of a narration task.
+    """
+    if schedule == 'segment':
+        return rows[0].segment_id
+    return f"{rows[0].video_id}/{rows[0].narration_id}"
+
+def process_plan_with_queue(queue_path, tasks, schedule, progress_csv_path, plan_columns, augmented_root, mask_cache_mb=256, mask_cache_dir=None, encoder_options=None, window_size=64, lease_seconds=300, workers=None, profile_dir=None, trace_allocations=False, annotations_root=None, compiled_root=None, source_clips_root=None):
+    """
+    Processes the plan as one of any number of workers sharing a `LeaseQueue`.
+
+    Every run adds the tasks of the whole plan to the queue (tasks already queued,
+    and completed, by another run are kept), then starts `workers` local processes that claim tasks until
+    the queue is drained. More runs can be started, on this or other hosts, at
+    any time; a run that is stopped returns its tasks to the queue when their
+    leases expire.
+    """
+    queue = LeaseQueue(queue_path, lease_seconds)
+    queue.bind_schedule(schedule)
+    # Rows are stored as records so the queue stays readable
+    added = queue.populate([(queue_task_id(rows, schedule), [row._asdict() for row in rows]) for rows in tasks])
+    print(f"Added {added} tasks to the work queue {queue_path}")
+
+    cache_stats = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(mask_cache_mb, mask_cache_dir, profile_dir, trace_allocations, annotations_root, compiled_root, source_clips_root)) as executor:
+        futures = [
+            executor.submit(run_queue_worker, queue_path, lease_seconds, augmented_root, encoder_options, window_size)
+            for _ in range(workers)
+        ]
+
+        with tqdm(desc="Processing Segments") as pbar:
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=5)
+                # The queue is shared with other runs, so report the progress of the whole queue
+                counts = queue.counts()
+                pbar.total = sum(counts.values())
+                pbar.n = counts.get('completed', 0) + counts.get('failed', 0)
+                pbar.refresh()
+
+        for future in futures:
+            for key, value in future.result().items():
+                cache_stats[key] = cache_stats.get(key, 0) + value
+
+    print_cache_stats(cache_stats)
+
+    # Export everything the queue finished so far, including the work of other runs
+    progress_data = pd.concat(
+        [ProgressJournal(progress_csv_path).read_progress(), pd.DataFrame(queue.finished_rows())],
+        ignore_index=True,
+    ).drop_duplicates(subset='segment_id', keep='last')
+    write_progress_csv(progress_data, progress_csv_path, plan_columns + ['status'])
+
+    counts = queue.counts()
+    if counts.get('failed'):
+        print(f"{counts['failed']} plan rows failed after {queue.max_attempts} attempts, see {progress_csv_path}")
     print(f"Augmentation processing completed. Progress saved to {progress_csv_path}")
-    
-def process_segment(augmented_root, row):
-    segment_id = row['segment_id']
-
-    # Skip segments that have already been completed
-    # if segment_id in completed_segments:
-    #   return row
-
-    narration_id = row['narration_id']
-    participant_id = row['participant_id']
-    video_id = row['video_id']
-    start_frame = row['start_frame']
-    stop_frame = row['stop_frame']
-    augment_type = row['augment_type']
-    
-    
-    if augment_type == "negative":
-        return row
-    
-    if isinstance(row['augment_params'], str):
-        params = eval(row['augment_params'])  # Convert string back to dict if needed
+
+def run_queue_worker(queue_path, lease_seconds, augmented_root, encoder_options=None, window_size=64):
+    queue = LeaseQueue(queue_path, lease_seconds)
+    owner = LeaseQueue.default_owner()
+    cache_stats = {}
+
+    while True:
+        task = queue.claim(owner)
+        if task is None:
+            # Tasks leased by other workers return to the queue if their worker dies
+            if not queue.has_unfinished():
+                return cache_stats
+            time.sleep(min(lease_seconds / 4, 10))
+            continue
+
+        task_id, records = task
+        rows = [PlanRow(**record) for record in records]
+        try:
+            with queue.hold(task_id, owner):
+                task_cache_stats, metrics = process_batch(augmented_root, rows, encoder_options, window_size)
+        except Exception as e:
+            print(f"Error processing task {task_id}: {e}")
+            queue.fail(task_id, owner, str(e))
+            continue
+
+        queue.complete(task_id, [dict(record, status='completed', **metrics.get(record['segment_id'], {})) for record in records])
+
+        for key, value in task_cache_stats.items():
+            cache_stats[key] = cache_stats.get(key, 0) + value
+
+def estimate_task_memory(rows, memory_model, frame_sizes, source_clips_root=None):
+    """
+    Predicts the peak memory (MB) of a task: the largest prediction over its source clips.
+
+    Args:
+        rows (list): `PlanRow`s of the task.
+        memory_model (MemoryModel): Model fitted to the peaks recorded so far.
+        frame_sizes (dict): (width, height) per video_id, filled in by probing a clip of new videos.
+        source_clips_root (str): Directory of the source clips, `CLIPS_ROOT` by default.
+    """
+    narrations = {}
+    for row in rows:
+        if row.augment_type != 'negative':
+            narrations.setdefault(row.narration_id, []).append(row)
+
+    peak_mb = 0.0
+    for narration_id, narration_rows in narrations.items():
+        video_id = narration_rows[0].video_id
+        if video_id not in frame_sizes:
+            # Assume full HD when the clip cannot be probed, to stay on the safe side
+            frame_sizes[video_id] = probe_frame_size(narration_clip_path(narration_id, source_clips_root)) or (1920, 1080)
+        width, height = frame_sizes[video_id]
+        frames = narration_rows[0].stop_frame - narration_rows[0].start_frame
+        peak_mb = max(peak_mb, memory_model.predict(width, height, frames, len(narration_rows)))
+    return peak_mb
+
+def run_tasks(tasks, total_rows, journal, augmented_root, mask_cache_mb=256, mask_cache_dir=None, encoder_options=None, window_size=64, workers=1, in_flight_per_worker=2, profile_dir=None, memory_budget_mb=None, trace_allocations=False, annotations_root=None, compiled_root=None, source_clips_root=None):
+    cache_stats = {}
+    tasks = iter(tasks)
+
+    # Learn how much memory clips take from earlier runs, and from every task as it completes
+    memory_model = MemoryModel(window_size)
+    frame_sizes = {}
+    if memory_budget_mb is not None:
+        progress_data = journal.read_progress()
+        memory_model.observe_progress(progress_data)
+        if 'frame_width' in progress_data:
+            recorded = progress_data.dropna(subset=['frame_width', 'frame_height']).drop_duplicates(subset='video_id')
+            frame_sizes = {video_id: (int(width), int(height)) for video_id, width, height in zip(recorded['video_id'], recorded['frame_width'], recorded['frame_height'])}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(mask_cache_mb, mask_cache_dir, profile_dir, trace_allocations, annotations_root, compiled_root, source_clips_root)) as executor:
+        futures = {}
+        next_rows = next(tasks, None)
+        in_flight_mb = 0.0
+
+        def submit_ready():
+            nonlocal next_rows, in_flight_mb
+            # Keep a bounded window of tasks in flight, refilled as tasks complete, so the
+            # parent never holds pickled copies of the whole plan and work starts immediately
+            while next_rows is not None and len(futures) < workers * in_flight_per_worker:
+                task_mb = estimate_task_memory(next_rows, memory_model, frame_sizes, source_clips_root) if memory_budget_mb is not None else 0.0
+                # Large tasks wait until enough of the memory budget is free, but a task
+                # always runs when nothing else is in flight
+                if futures and in_flight_mb + task_mb > (memory_budget_mb or np.inf):
+                    return
+                futures[executor.submit(process_batch, augmented_root, next_rows, encoder_options, window_size)] = (next_rows, task_mb)
+                in_flight_mb += task_mb
+                next_rows = next(tasks, None)
+
+        submit_ready()
+
+        with tqdm(total=total_rows, desc="Processing Segments") as pbar:
+            # Use tqdm to track progress
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rows, task_mb = futures.pop(future)
+                    in_flight_mb -= task_mb
+                    try:
+                        batch_cache_stats, metrics = future.result()
+                        for key, value in batch_cache_stats.items():
+                            cache_stats[key] = cache_stats.get(key, 0) + value
+
+                        observe_task_memory(memory_model, rows, metrics)
+
+                        # Append to the journal after each completed task to avoid data loss
+                        journal.append([dict(row._asdict(), status='completed', **metrics.get(row.segment_id, {})) for row in rows])
+                    except Exception as e:
+                        print(f"Error processing video: {e}")
+                        raise e
+
+                    pbar.update(len(rows))
+                submit_ready()
+
+    print_cache_stats(cache_stats)
+
+def observe_task_memory(memory_model, rows, metrics):
+    # One sample per source clip, its segments share the same peak
+    clips = {}
+    for row in rows:
+        if row.segment_id in metrics:
+            clips.setdefault(row.narration_id, metrics[row.segment_id])
+
+    for record in clips.values():
+        units = memory_model.units(record['frame_width'], record['frame_height'], record['frames'], record['group_segments'])
+        memory_model.observe(units, record['peak_rss_mb'])
+
+def print_cache_stats(cache_stats):
+    for name, label in [('annotation', 'Annotation'), ('mask', 'Occlusion mask')]:
+        hits, misses = cache_stats.get(f'{name}_hits', 0), cache_stats.get(f'{name}_misses', 0)
+        if hits + misses:
+            print(f"{label} cache hit rate: {hits / (hits + misses):.1%} ({hits} hits, {misses} misses)")
+
+
+def narration_clip_path(narration_id, source_clips_root=None):
+    return os.path.join(source_clips_root or clips_root, f'{narration_id}.mp4')
+
+def prepare_segment(row, frame_count):
+    operator = get_operator(row['augment_type'])
+    # Can't use end_frame because FPS is not consistent
+    frame_iterator = range(row['start_frame'], row['start_frame'] + frame_count)
+
+    state = operator.prepare(row, parse_augment_params(row['augment_params']), frame_iterator, operator_context())
+
+    return {
+        'operator': operator,
+        'state': state,
+        'frames_needed': np.asarray(operator.frames_needed(state, frame_count), dtype=np.int64),
+        'buffer': None,
+    }
+
+def augment_window(segment, window_indices, window_frames, in_place=False):
+    """
+    Applies a segment's operator to the frames of one decoded window it needs, returning the frames to write.
+
+    With `in_place`, operators that support it transform `window_frames` itself,
+    so it must not be used by any other segment afterwards. Otherwise they write
+    to a buffer of the segment that is reused for every window, so the returned
+    frames are only valid until the next call.
+    """
+    operator = segment['operator']
+    window_frames, window_indices = select_needed_frames(window_frames, window_indices, segment['frames_needed'])
+    if len(window_frames) == 0:
+        return window_frames
+    if window_frames.dtype != operator.dtype:
+        window_frames = window_frames.astype(operator.dtype)
+
+    if in_place and operator.in_place:
+        out = window_frames
     else:
-        params = None
+        if segment['buffer'] is None or segment['buffer'].shape[1:] != window_frames.shape[1:] or len(segment['buffer']) < len(window_frames):
+            segment['buffer'] = np.empty_like(window_frames)
+        out = segment['buffer'][:len(window_frames)]
 
-    # Directory to save augmented frames
-    augmented_video_path = os.path.join(augmented_root, f"{segment_id}.mp4")
-    Path(augmented_root).mkdir(parents=True, exist_ok=True)
-    
+    return operator.apply(window_frames, window_indices, segment['state'], out=out)
 
-    with open(f'../../processed_videos/clipped_resized_videos/{narration_id}.mp4', 'rb') as fid:
-        # Load a video
-        vr = VideoReader(fid, ctx=cpu(0))
+def process_narration_segments(augmented_root, rows, encoder_options=None, window_size=64):
+    """
+    Processes plan rows that share a narration_id, decoding their source clip only once.
 
-        try:
-            # Path to save videos
-            # original_video_path = os.path.join(augment_dir, "original_video.mp4")
-
-            # Initialize variables for VideoWriter
-            # original_video_writer = None
-            augmented_video_writer = None
-
-            # Loop through the frames
-            
-            
-            
-            new_frames = []
-            
-            frames = vr.get_batch(range(0, len(vr) - 1))
-            # `frame` is a decord NDArray, which can be converted to a numpy array
-            # frames = [frame.asnumpy() for frame in frames]
-            frames = frames.asnumpy()
-            # print(len(frame_iterator), len(frames))
-            
-            # Can't use end_frame because FPS is not consistent
-            frame_iterator = range(start_frame, start_frame + len(frames))
-            total_frames = len(frame_iterator)
-            
-            # for (i, frame_num) in tqdm(enumerate(frame_iterator), desc=f"Segment {segment_id} [{augment_type}]", leave=False):
-            for (i, frame_num) in enumerate(frame_iterator):
-                frame = frames[i]
-                # `frame` is a decord NDArray, which can be converted to a numpy array
-                # frame = frame.asnumpy()
-                # Convert the frame from BGR to RGB
-                # frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-
-                # original_frame_path = os.path.join(row['original_frame_dir'], f"frame_{frame_num:010}.jpg")
-                # augmented_frame_path = os.path.join(augment_dir, f"frame_{frame_num:010}.jpg")
-
-                # Read the original frame
-                # frame = cv2.imread(original_frame_path)
-
-                # Dynamically determine frame size and initialize VideoWriter (only on the first frame)
-                # if augmented_video_writer is None:
-                #     frame_size = (frame.shape[1], frame.shape[0])  # (Width, Height)
-                #     fps = vr.get_avg_fps()  # Frames per second, adjust if necessary
-
-                    # Initialize Video Writers for original and augmented videos
-                    # original_video_writer = cv2.VideoWriter(original_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
-                    # augmented_video_writer = cv2.VideoWriter(augmented_video_path, cv2.VideoWriter_fourcc('H','2','6','4'), fps, frame_size)
-
-                # Apply the augmentation with the given parameters
-                augmented_frame = apply_augmentations(row, frame, i, total_frames, frame_num, augment_type, params)
-
-                # Save the augmented frame
-                # cv2.imwrite(augmented_frame_path, augmented_frame)
-
-                # Write frames to the video writers
-                # original_video_writer.write(frame)
-                # augmented_video_writer.write(frame)
-                if augmented_frame is not None:
-                    new_frames.append(augmented_frame)
-
-            # Release the video writers
-            # if augmented_video_writer is not None:
-            #     augmented_video_writer.release()
-            
-            fps = vr.get_avg_fps()
+    The clip is decoded `window_size` frames at a time. Each window is fanned out
+    to every planned augmentation and streamed to that segment's encoder, so
+    memory stays bounded regardless of the clip length.
 
-            # Create a video clip from the frames (note that frames should be in RGB format for moviepy)
-            clip = ImageSequenceClip(new_frames, fps=fps)
+    The time spent in every stage (open, decode, augment, encode and write) and
+    the number of frames are recorded on each processed row, see `segment_timings`.
+    """
+    # Negative samples reuse the original clip, there is nothing to render
+    pending_rows = [row for row in rows if row['augment_type'] != "negative"]
+    if not pending_rows:
+        return rows
 
-            # Write the video to a file
-            clip.write_videofile(augmented_video_path, codec='libx264', fps=fps, logger=None)
+    Path(augmented_root).mkdir(parents=True, exist_ok=True)
 
-            # Update tqdm with the current processing status
+    shared_timer = StageTimer()
+    timers = [StageTimer() for _ in pending_rows]
 
-            # mark_completed(row, progress_data, completed_segments)
-            # progress_data = mark_completed(row, progress_data, completed_segments)
-            return row
+    with shared_timer.time('open'):
+        fid = open(narration_clip_path(pending_rows[0]['narration_id']), 'rb')
+    with fid:
+        with shared_timer.time('open'):
+            # Load a video
+            vr = VideoReader(fid, ctx=cpu(0))
+            fps = vr.get_avg_fps()
+            frame_count = len(vr) - 1
+
+        writers = []
+        frame_height, frame_width = 0, 0
+        try:
+            segments = []
+            for row, timer in zip(pending_rows, timers):
+                with timer.time('augment'):
+                    segments.append(prepare_segment(row, frame_count))
+            writers = [
+                StreamingVideoWriter(os.path.join(augmented_root, f"{row['segment_id']}.mp4"), fps, **(encoder_options or {}))
+                for row in pending_rows
+            ]
+
+            # Only decode the frames some operator needs, e.g. the kept prefix of a completeness segment
+            decode_indices = union_frame_indices([segment['frames_needed'] for segment in segments], frame_count)
+
+            # Decode the next window in the background while the current one is augmented and encoded
+            windows = shared_timer.timed_iter('decode', iter_frame_windows(vr, decode_indices, window_size))
+            for window_indices, window_frames in prefetch(windows):
+                frame_height, frame_width = window_frames.shape[1:3]
+                for k, (segment, writer, timer) in enumerate(zip(segments, writers, timers)):
+                    with timer.time('augment'):
+                        # Each operator runs once per window; the last segment may reuse the window's memory
+                        frames = augment_window(segment, window_indices, window_frames, in_place=k == len(segments) - 1)
+                    with timer.time('encode'):
+                        writer.write_frames(frames)
+
+            for writer, timer in zip(writers, timers):
+                with timer.time('write'):
+                    writer.close()
         except Exception as e:
-            # tqdm.write(f"Error processing segment {segment_id}: {e}")
-            row['status'] = f'error: {e}'
-            # traceback.print_stack()
+            for writer in writers:
+                writer.abort()
+            for row in pending_rows:
+                row['status'] = f'error: {e}'
             raise e
 
-            progress_data = pd.concat([progress_data, pd.DataFrame([row])], ignore_index=True)
-            progress_data.to_csv(progress_csv_path, index=False)
+    for row, writer, timer in zip(pending_rows, writers, timers):
+        row.update(segment_timings(shared_timer, timer, len(pending_rows)))
+        row['frames'] = frame_count
+        row['frames_decoded'] = len(decode_indices)
+        row['frames_written'] = writer.frames_written
+        row['bytes_written'] = os.path.getsize(writer.path)
+        row['frame_width'] = frame_width
+        row['frame_height'] = frame_height
+        row['group_segments'] = len(pending_rows)
+
+    return rows
+
+# Fields recorded in the progress of every rendered segment
+SEGMENT_METRICS = [f'{stage}_s' for stage in STAGES] + ['frames', 'frames_decoded', 'frames_written', 'bytes_written', 'frame_width', 'frame_height', 'group_segments']
+
+# Fields recorded by `MemoryTracker` for every source clip, shared by its segments
+MEMORY_METRICS = ['peak_rss_mb', 'tracemalloc_peak_mb', 'tracemalloc_top']
+
+def process_batch(augmented_root, rows, encoder_options=None, window_size=64):
+    """
+    Processes a scheduled task, e.g. every pending row of one video, in a pool worker.
+
+    Args:
+        rows (list): `PlanRow`s of the task.
+
+    Returns:
+        tuple: The worker's cache hits and misses while processing the rows, and the
+               stage timings and peak memory of every rendered segment by segment_id.
+    """
+    before = cache_counters()
+
+    narrations = {}
+    for row in rows:
+        narrations.setdefault(row.narration_id, []).append(row._asdict())
+
+    metrics = {}
+    for narration_rows in narrations.values():
+        # The segments of a clip are processed together, so they share one peak
+        with MemoryTracker(trace_allocations=tracemalloc.is_tracing()) as tracker:
+            process_narration_segments(augmented_root, narration_rows, encoder_options, window_size)
+
+        for row in narration_rows:
+            if 'frames' in row:
+                metrics[row['segment_id']] = dict({key: row[key] for key in SEGMENT_METRICS}, **tracker.record)
+
+    dump_worker_profile()
+
+    after = cache_counters()
+    return {key: after[key] - before[key] for key in after}, metrics
+
+def process_segment(augmented_root, row, encoder_options=None, window_size=64):
+    return process_narration_segments(augmented_root, [row], encoder_options, window_size)[0]
+
+def compile_annotations_for_videos(annotations_root, compiled_root, video_ids=None):
+    # Compile every VISOR file in the root unless specific videos were requested
+    if not video_ids:
+        video_ids = sorted(os.path.splitext(f)[0] for f in os.listdir(annotations_root) if f.endswith('.json'))
+
+    os.makedirs(compiled_root, exist_ok=True)
+
+    with ProcessPoolExecutor() as executor:
+        futures = {
+            executor.submit(compile_annotations, video_id, annotations_root, compiled_root): video_id
+            for video_id in video_ids
+        }
+
+        with tqdm(total=len(futures), desc="Compiling Annotations") as pbar:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error compiling annotations for {futures[future]}: {e}")
+                    raise e
+
+                pbar.update(1)
+
+    print(f"Compiled annotations for {len(video_ids)} videos into {compiled_root}")
 
 def main():
     parser = argparse.ArgumentParser(description="CLI for generating and processing video augmentations.")
@@ -472,22 +965,110 @@ def main():
     generate_plan_parser = subparsers.add_parser('generate-plan', help="Generate an augmentation plan.")
     generate_plan_parser.add_argument('--csv-path', type=str, required=True, help="Path to the original CSV file.")
     generate_plan_parser.add_argument('--original-root', type=str, required=True, help="Path to the original video frames root directory.")
-    generate_plan_parser.add_argument('--plan-csv-path', type=str, required=True, help="Path to save the generated augmentation plan CSV.")
+    generate_plan_parser.add_argument('--plan-csv-path', '--plan-path', type=str, required=True, help="Path to save the generated augmentation plan (typed Parquet if it ends in .parquet, CSV otherwise).")
     generate_plan_parser.add_argument('--augmented-segments-csv-path', type=str, required=True, help="Path to save the augmented segments CSV.")
+    generate_plan_parser.add_argument('--negative-samples-count', type=int, default=1, help="Number of negative examples sampled per segment.")
+    generate_plan_parser.add_argument('--seed', type=int, help="Seed for sampling negative examples, for reproducible plans.")
+    generate_plan_parser.add_argument('--composites', type=str, nargs='*', help="Composite augmentations applied in one pass, e.g. darken+occlusion darken+occlusion+completeness.")
+    generate_plan_parser.add_argument('--extra-augmentations', type=str, nargs='*', choices=EXTRA_AUGMENTATIONS, help="Camera degradations to add for every row, e.g. motion_blur camera_shake sensor_noise.")
+    generate_plan_parser.add_argument('--darken-gamma', type=float, default=DEFAULT_DARKEN_GAMMA, help="Gamma of the darken augmentation; higher is darker.")
+    generate_plan_parser.add_argument('--annotations-root', type=str, default=VISOR_ANNOTATIONS_ROOT, help="Directory containing the VISOR {video_id}.json files.")
+    generate_plan_parser.add_argument('--compiled-root', type=str, default=COMPILED_ANNOTATIONS_ROOT, help="Directory of the compiled annotation indexes, see compile-annotations.")
 
 
     # Command for processing the augmentation plan
     process_plan_parser = subparsers.add_parser('process-plan', help="Process the augmentation plan.")
     process_plan_parser.add_argument('--progress-csv-path', type=str, required=True, help="Path to save the progress of augmentation processing.")
-    process_plan_parser.add_argument('--plan-csv-path', type=str, required=True, help="Path to the augmentation plan CSV.")
+    process_plan_parser.add_argument('--plan-csv-path', '--plan-path', type=str, required=True, help="Path to the augmentation plan (Parquet or CSV).")
     process_plan_parser.add_argument('--augmented-root', type=str, required=True, help="Root directory to save augmented frames.")
+    process_plan_parser.add_argument('--mask-cache-mb', type=int, default=256, help="Memory budget (MB) of each worker's occlusion mask cache.")
+    process_plan_parser.add_argument('--mask-cache-dir', type=str, help="Optional directory to spill rasterized occlusion masks to, shared by all workers.")
+    process_plan_parser.add_argument('--codec', type=str, default='libx264', help="ffmpeg video codec used to encode augmented segments.")
+    process_plan_parser.add_argument('--preset', type=str, default='medium', help="ffmpeg encoder preset.")
+    process_plan_parser.add_argument('--crf', type=int, help="Optional constant rate factor (ffmpeg's default is used when omitted).")
+    process_plan_parser.add_argument('--window-size', type=int, default=64, help="Number of frames decoded, augmented and encoded at a time.")
+    process_plan_parser.add_argument('--schedule', type=str, choices=['segment', 'narration', 'video'], help="How plan rows are batched across workers: one task per segment, per source clip, or per video (the default, or narration with --queue-path).")
+    process_plan_parser.add_argument('--batch-size', type=int, help="Maximum number of plan rows per video task, so progress is saved more often on videos with many segments.")
+    process_plan_parser.add_argument('--group-by-narration', action='store_true', help="Same as --schedule narration.")
+    process_plan_parser.add_argument('--num-shards', type=int, default=1, help="Split the plan into this many shards, e.g. one per host.")
+    process_plan_parser.add_argument('--shard-index', type=int, default=0, help="Shard processed by this run, from 0 to --num-shards - 1.")
+    process_plan_parser.add_argument('--queue-path', type=str, help="SQLite work queue shared by every run processing the plan, on any host. Runs can be added or stopped at any time.")
+    process_plan_parser.add_argument('--lease-seconds', type=int, default=300, help="Lease of a claimed queue task; the task returns to the queue if its worker stops renewing it.")
+    process_plan_parser.add_argument('--workers', type=int, help="CPU budget: maximum number of worker processes (defaults to the number of CPUs).")
+    process_plan_parser.add_argument('--memory-budget-mb', type=int, help="Memory budget (MB) of all workers together; limits the number of workers and how many large clips run at once.")
+    process_plan_parser.add_argument('--tracemalloc', action='store_true', help="Record the tracemalloc peak and top allocation sites of every clip in the progress (slows processing).")
+    process_plan_parser.add_argument('--worker-memory-mb', type=int, default=1024, help="Expected peak memory (MB) of one worker, used with --memory-budget-mb.")
+    process_plan_parser.add_argument('--profile', type=str, nargs='?', const='', metavar='DIR', help="Dump cProfile stats of every worker to DIR (defaults to {progress-csv-path}.profile).")
+    process_plan_parser.add_argument('--annotations-root', type=str, default=VISOR_ANNOTATIONS_ROOT, help="Directory containing the VISOR {video_id}.json files.")
+    process_plan_parser.add_argument('--compiled-root', type=str, default=COMPILED_ANNOTATIONS_ROOT, help="Directory of the compiled annotation indexes, see compile-annotations.")
+    process_plan_parser.add_argument('--clips-root', type=str, default=CLIPS_ROOT, help="Directory containing the source clips {narration_id}.mp4.")
+
+    # Command for summarizing the stage timings of a run
+    report_parser = subparsers.add_parser('report', help="Summarize stage throughput and timing histograms of a run.")
+    report_parser.add_argument('--progress-csv-path', type=str, required=True, help="Progress CSV of the run.")
+    report_parser.add_argument('--profile-dir', type=str, help="Optional directory of worker profiles written with --profile.")
+    report_parser.add_argument('--top', type=int, default=25, help="Number of functions listed from the profiles.")
+
+    # Command for estimating the cost of processing a plan
+    estimate_parser = subparsers.add_parser('estimate', help="Estimate the CPU-hours, wall-clock time and output size of processing a plan.")
+    estimate_parser.add_argument('--plan-csv-path', '--plan-path', type=str, required=True, help="Path to the augmentation plan (Parquet or CSV).")
+    estimate_parser.add_argument('--calibration-progress', type=str, nargs='*', help="Progress CSVs of earlier runs to calibrate throughput from.")
+    estimate_parser.add_argument('--sample-narrations', type=int, default=0, help="Calibrate by processing every plan row of this many randomly sampled source clips.")
+    estimate_parser.add_argument('--sample-dir', type=str, help="Directory to keep the sample run in (defaults to a temporary directory that is removed).")
+    estimate_parser.add_argument('--progress-csv-path', type=str, help="Progress of the run to estimate, so completed segments are left out.")
+    estimate_parser.add_argument('--workers', type=int, nargs='+', default=[os.cpu_count() or 1], help="Worker counts to estimate the wall-clock time for.")
+    estimate_parser.add_argument('--schedule', type=str, choices=['segment', 'narration', 'video'], default='video', help="Schedule of the run, which sets the largest task.")
+    estimate_parser.add_argument('--codec', type=str, default='libx264', help="ffmpeg video codec of the sample run.")
+    estimate_parser.add_argument('--preset', type=str, default='medium', help="ffmpeg encoder preset of the sample run.")
+    estimate_parser.add_argument('--crf', type=int, help="Optional constant rate factor of the sample run.")
+    estimate_parser.add_argument('--window-size', type=int, default=64, help="Number of frames decoded at a time in the sample run.")
+    estimate_parser.add_argument('--seed', type=int, help="Seed for sampling source clips.")
+    estimate_parser.add_argument('--annotations-root', type=str, default=VISOR_ANNOTATIONS_ROOT, help="Directory containing the VISOR {video_id}.json files.")
+    estimate_parser.add_argument('--compiled-root', type=str, default=COMPILED_ANNOTATIONS_ROOT, help="Directory of the compiled annotation indexes, see compile-annotations.")
+    estimate_parser.add_argument('--clips-root', type=str, default=CLIPS_ROOT, help="Directory containing the source clips {narration_id}.mp4.")
+
+    # Command for merging the progress of sharded runs
+    merge_progress_parser = subparsers.add_parser('merge-progress', help="Merge the progress of every shard into the progress CSV.")
+    merge_progress_parser.add_argument('--progress-csv-path', type=str, required=True, help="Progress CSV path given to the sharded process-plan runs.")
+    merge_progress_parser.add_argument('--num-shards', type=int, help="Number of shards (defaults to every shard found next to the progress CSV).")
+
+    # Command for compiling VISOR annotations into memory-mappable arrays
+    compile_annotations_parser = subparsers.add_parser('compile-annotations', help="Compile VISOR JSON annotations into a binary index.")
+    compile_annotations_parser.add_argument('--annotations-root', type=str, default=VISOR_ANNOTATIONS_ROOT, help="Directory containing the VISOR {video_id}.json files.")
+    compile_annotations_parser.add_argument('--compiled-root', type=str, default=COMPILED_ANNOTATIONS_ROOT, help="Directory to save the compiled annotation indexes.")
+    compile_annotations_parser.add_argument('--video-ids', type=str, nargs='*', help="Only compile these videos (defaults to every JSON file in the annotations root).")
 
     args = parser.parse_args()
 
     if args.command == "generate-plan":
-        generate_augmentation_plan(args.csv_path, args.original_root, args.plan_csv_path, args.augmented_segments_csv_path)
+        generate_augmentation_plan(args.csv_path, args.original_root, args.plan_csv_path, args.augmented_segments_csv_path, args.negative_samples_count, args.seed, args.darken_gamma, args.composites, args.extra_augmentations, args.annotations_root, args.compiled_root)
     elif args.command == "process-plan":
-        process_augmentation_plan(args.plan_csv_path, args.augmented_root, args.progress_csv_path)
+        encoder_options = {'codec': args.codec, 'preset': args.preset, 'crf': args.crf}
+        if not 0 <= args.shard_index < args.num_shards:
+            parser.error("--shard-index must be between 0 and --num-shards - 1")
+        if args.queue_path is not None and args.num_shards > 1:
+            parser.error("--queue-path replaces static sharding, do not combine it with --num-shards")
+        schedule = 'narration' if args.group_by_narration else args.schedule
+        if args.queue_path is not None:
+            # Queue tasks are claimed one source clip or segment at a time, so no whole video becomes the tail of the run
+            if schedule == 'video' or args.batch_size is not None:
+                parser.error("--queue-path queues one task per source clip (--schedule narration, the default) or per segment (--schedule segment)")
+            schedule = schedule or 'narration'
+        schedule = schedule or 'video'
+        workers = resolve_worker_count(args.workers, args.memory_budget_mb, args.worker_memory_mb)
+        profile_dir = None if args.profile is None else (args.profile or f"{args.progress_csv_path}.profile")
+        process_augmentation_plan(args.plan_csv_path, args.augmented_root, args.progress_csv_path, args.mask_cache_mb, args.mask_cache_dir, schedule, encoder_options, args.window_size, args.batch_size, args.num_shards, args.shard_index, args.queue_path, args.lease_seconds, workers, profile_dir, args.memory_budget_mb, args.tracemalloc, args.annotations_root, args.compiled_root, args.clips_root)
+    elif args.command == "report":
+        report_progress(args.progress_csv_path, args.profile_dir, args.top)
+    elif args.command == "estimate":
+        if not args.calibration_progress and not args.sample_narrations:
+            parser.error("estimate needs --calibration-progress and/or --sample-narrations to calibrate throughput")
+        encoder_options = {'codec': args.codec, 'preset': args.preset, 'crf': args.crf}
+        estimate_plan(args.plan_csv_path, args.calibration_progress, args.workers, args.progress_csv_path, args.sample_narrations, args.sample_dir, args.schedule, encoder_options, args.window_size, args.seed, args.annotations_root, args.compiled_root, args.clips_root)
+    elif args.command == "merge-progress":
+        merge_shard_progress(args.progress_csv_path, args.num_shards)
+    elif args.command == "compile-annotations":
+        compile_annotations_for_videos(args.annotations_root, args.compiled_root, args.video_ids)
     else:
         parser.print_help()
 
@@ -1,10 +1,12 @@
 import json
-from sortedcontainers import SortedDict
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import shutil
+import functools
+from geometry import flatten_polygons, scale_polygons, min_area_rectangles, fill_rectangles
 
 def generate_colors(num_classes):
     """
@@ -56,67 +58,243 @@ def extract_frame_id(frame_annotation_metadata):
     
     return frame_id
 
-def has_visor(video_id):
-    return os.path.exists(annotation_path(video_id))
+# Root directories for the raw VISOR JSON files and their compiled counterparts
+VISOR_ANNOTATIONS_ROOT = "/home/ec2-user/environment/data/visor-annotations"
+COMPILED_ANNOTATIONS_ROOT = "/home/ec2-user/environment/data/visor-annotations-compiled"
 
-def annotation_path(video_id):
-    return f"/home/ec2-user/environment/data/visor-annotations/{video_id}.json"
+# Arrays making up a compiled annotation index, each stored as `{name}.npy`
+INDEX_ARRAYS = ('frame_ids', 'frame_offsets', 'class_ids', 'annotation_offsets', 'segment_offsets', 'vertices')
 
-def load_annotations(video_id):
+def has_visor(video_id, annotations_root=None, compiled_root=None):
+    return os.path.exists(annotation_path(video_id, annotations_root)) or os.path.exists(compiled_annotation_path(video_id, compiled_root))
+
+def list_visor_videos(annotations_root=None, compiled_root=None):
     """
-    Loads annotations from a JSON file based on `video_id` and organizes them in a SortedDict by frame_id.
+    Lists the videos that have VISOR annotations, raw or compiled.
+
+    Each directory is listed once, which is much cheaper than calling `has_visor`
+    for every row of a large dataset.
+
+    Args:
+        annotations_root (str): Directory of VISOR JSON files. Defaults to `VISOR_ANNOTATIONS_ROOT`.
+        compiled_root (str): Directory of compiled indexes. Defaults to `COMPILED_ANNOTATIONS_ROOT`.
+
+    Returns:
+        set: The video IDs with annotations.
+    """
+    video_ids = set()
+
+    annotations_root = annotations_root or VISOR_ANNOTATIONS_ROOT
+    if os.path.isdir(annotations_root):
+        video_ids.update(os.path.splitext(f)[0] for f in os.listdir(annotations_root) if f.endswith('.json'))
+
+    compiled_root = compiled_root or COMPILED_ANNOTATIONS_ROOT
+    if os.path.isdir(compiled_root):
+        video_ids.update(f for f in os.listdir(compiled_root) if os.path.isdir(os.path.join(compiled_root, f)) and '.tmp-' not in f)
+
+    return video_ids
+
+def annotation_path(video_id, annotations_root=None):
+    return os.path.join(annotations_root or VISOR_ANNOTATIONS_ROOT, f"{video_id}.json")
+
+def compiled_annotation_path(video_id, compiled_root=None):
+    return os.path.join(compiled_root or COMPILED_ANNOTATIONS_ROOT, video_id)
+
+class AnnotationIndex:
+    """
+    Columnar view over the VISOR annotations of a single video.
+
+    Frames are stored as a sorted `frame_ids` array. Each frame owns a range of
+    annotations (`frame_offsets`), each annotation owns a range of polygons
+    (`annotation_offsets`) and each polygon owns a range of rows in the flat
+    float32 `vertices` array (`segment_offsets`). All offset arrays have one more
+    entry than the items they describe, so item `i` spans `[offsets[i], offsets[i + 1])`.
+    """
+
+    def __init__(self, video_id, arrays):
+        self.video_id = video_id
+        self.frame_ids = arrays['frame_ids']
+        self.frame_offsets = arrays['frame_offsets']
+        self.class_ids = arrays['class_ids']
+        self.annotation_offsets = arrays['annotation_offsets']
+        self.segment_offsets = arrays['segment_offsets']
+        self.vertices = arrays['vertices']
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def __contains__(self, frame_id):
+        pos = np.searchsorted(self.frame_ids, frame_id)
+        return pos < len(self.frame_ids) and self.frame_ids[pos] == frame_id
+
+    def frame(self, pos):
+        """
+        Builds the annotations of the frame at position `pos` in `frame_ids`.
+
+        Args:
+            pos (int): Position of the frame in the sorted `frame_ids` array.
+
+        Returns:
+            dict: The frame annotations in the VISOR layout, i.e.
+                  `{'annotations': [{'class_id': int, 'segments': [np.ndarray]}]}`.
+                  Segments are (N, 2) float32 views into `vertices`. The vertices of
+                  every segment of the frame are also included as one flat array
+                  (`vertices`) with frame-local `segment_offsets`.
+        """
+        frame_annotations = []
+        for a in range(self.frame_offsets[pos], self.frame_offsets[pos + 1]):
+            segments = [
+                self.vertices[self.segment_offsets[s]:self.segment_offsets[s + 1]]
+                for s in range(self.annotation_offsets[a], self.annotation_offsets[a + 1])
+            ]
+            frame_annotations.append({'class_id': int(self.class_ids[a]), 'segments': segments})
+
+        first_segment = self.annotation_offsets[self.frame_offsets[pos]]
+        last_segment = self.annotation_offsets[self.frame_offsets[pos + 1]]
+        segment_offsets = np.asarray(self.segment_offsets[first_segment:last_segment + 1])
+
+        return {
+            'frame_id': int(self.frame_ids[pos]),
+            'annotations': frame_annotations,
+            'vertices': self.vertices[segment_offsets[0]:segment_offsets[-1]],
+            'segment_offsets': segment_offsets - segment_offsets[0],
+        }
+
+def build_annotation_arrays(data):
+    """
+    Converts parsed VISOR JSON into the columnar arrays used by `AnnotationIndex`.
+
+    Args:
+        data (dict): Parsed contents of a VISOR `{video_id}.json` file.
+
+    Returns:
+        dict: A dictionary mapping each name in `INDEX_ARRAYS` to a NumPy array.
+    """
+    # Later entries for the same frame replace earlier ones, as they did in the SortedDict
+    frames_by_id = {}
+    for frame in data['video_annotations']:
+        frames_by_id[extract_frame_id(frame['image'])] = frame
+
+    frame_ids = sorted(frames_by_id)
+    frame_offsets = [0]
+    class_ids = []
+    annotation_offsets = [0]
+    segment_offsets = [0]
+    vertices = []
+
+    for frame_id in frame_ids:
+        for annotation in frames_by_id[frame_id]['annotations']:
+            class_ids.append(annotation['class_id'])
+            for segment in annotation['segments']:
+                vertices.extend(segment)
+                segment_offsets.append(len(vertices))
+            annotation_offsets.append(len(segment_offsets) - 1)
+        frame_offsets.append(len(class_ids))
+
+    return {
+        'frame_ids': np.array(frame_ids, dtype=np.int64),
+        'frame_offsets': np.array(frame_offsets, dtype=np.int64),
+        'class_ids': np.array(class_ids, dtype=np.int32),
+        'annotation_offsets': np.array(annotation_offsets, dtype=np.int64),
+        'segment_offsets': np.array(segment_offsets, dtype=np.int64),
+        # Vertices keep their fractional part: they are scaled to the frame size first and truncated after
+        'vertices': np.array(vertices, dtype=np.float64).reshape(-1, 2).astype(np.float32),
+    }
+
+def compile_annotations(video_id, annotations_root=None, compiled_root=None):
+    """
+    Compiles a VISOR JSON file into a directory of `.npy` arrays that can be memory-mapped.
+
+    The arrays are written to a temporary directory first and renamed into place,
+    so a partially written index is never picked up by `load_annotations`.
 
     Args:
         video_id (str): Video ID
+        annotations_root (str): Directory containing the VISOR `{video_id}.json` files.
+                                Defaults to `VISOR_ANNOTATIONS_ROOT`.
+        compiled_root (str): Directory to write the compiled index to.
+                             Defaults to `COMPILED_ANNOTATIONS_ROOT`.
 
     Returns:
-        SortedDict: A SortedDict where keys are frame_ids and values are lists of annotations for that frame.
+        str: Path of the compiled index directory.
     """
-    with open(annotation_path(video_id), 'r') as f:
+    with open(annotation_path(video_id, annotations_root), 'r') as f:
         data = json.load(f)
 
-    annotations_by_frame = SortedDict()
+    arrays = build_annotation_arrays(data)
 
-    for frame in data['video_annotations']:
-        
-        frame_id = extract_frame_id(frame['image'])
-        # frame_id = int(frame['image']['frame_id'])  # Assuming the JSON contains a 'frame_id' key
-        annotations_by_frame[frame_id] = frame
+    output_dir = compiled_annotation_path(video_id, compiled_root)
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
 
-    return annotations_by_frame
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.rename(tmp_dir, output_dir)
 
-def find_nearest_annotations(frame_id, annotations_by_frame):
+    return output_dir
+
+def load_annotations(video_id, annotations_root=None, compiled_root=None):
     """
-    Finds the nearest annotations for a given frame_id using a SortedDict.
+    Loads the annotations of `video_id` as an `AnnotationIndex`.
+
+    The compiled index produced by `compile_annotations` is memory-mapped when it
+    exists. Otherwise the VISOR JSON file is parsed and converted in memory.
 
     Args:
-        frame_id (int): The frame ID for which to retrieve annotations.
-        annotations_by_frame (SortedDict): SortedDict of annotations organized by frame_id.
+        video_id (str): Video ID
+        annotations_root (str): Directory of VISOR JSON files. Defaults to `VISOR_ANNOTATIONS_ROOT`.
+        compiled_root (str): Directory of compiled indexes. Defaults to `COMPILED_ANNOTATIONS_ROOT`.
 
     Returns:
-        list: The nearest annotations for the given frame_id.
+        AnnotationIndex: The annotations of the video, ordered by frame_id.
     """
-    # If the exact frame_id exists in the dictionary, return its annotations
-    if frame_id in annotations_by_frame:
-        return annotations_by_frame[frame_id]
-
-    # Find the position where frame_id would be inserted to keep the keys sorted
-    pos = annotations_by_frame.bisect_left(frame_id)
+    compiled_dir = compiled_annotation_path(video_id, compiled_root)
 
-    if pos == 0:
-        # No smaller frame_id, return the annotations for the first frame_id
-        nearest_frame_id = annotations_by_frame.keys()[0]
-    elif pos == len(annotations_by_frame):
-        # No larger frame_id, return the annotations for the last frame_id
-        nearest_frame_id = annotations_by_frame.keys()[-1]
+    if os.path.isdir(compiled_dir):
+        arrays = {name: np.load(os.path.join(compiled_dir, f"{name}.npy"), mmap_mode='r') for name in INDEX_ARRAYS}
     else:
-        # Nearest frame_id is either just before or just after the given frame_id
-        prev_frame_id = annotations_by_frame.keys()[pos - 1]
-        next_frame_id = annotations_by_frame.keys()[pos]
-        # Choose the closer frame_id between prev_frame_id and next_frame_id
-        nearest_frame_id = prev_frame_id if (frame_id - prev_frame_id) <= (next_frame_id - frame_id) else next_frame_id
+        with open(annotation_path(video_id, annotations_root), 'r') as f:
+            arrays = build_annotation_arrays(json.load(f))
+
+    return AnnotationIndex(video_id, arrays)
+
+def find_nearest_annotation_positions(frame_ids, annotations_by_frame):
+    """
+    Finds the position of the nearest annotated frame for every frame in `frame_ids` at once.
+
+    Args:
+        frame_ids (array-like): Frame IDs to look up, e.g. the `frame_iterator` of a segment.
+        annotations_by_frame (AnnotationIndex): Annotations organized by frame_id.
+
+    Returns:
+        np.ndarray: For each frame, the position of its nearest annotated frame in
+                    `annotations_by_frame.frame_ids`. Ties go to the earlier frame.
+    """
+    keys = annotations_by_frame.frame_ids
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+
+    # The nearest frame_id is either the first key >= frame_id or the one just before it
+    right = np.minimum(np.searchsorted(keys, frame_ids), len(keys) - 1)
+    left = np.maximum(right - 1, 0)
+    choose_left = (frame_ids - keys[left]) <= (keys[right] - frame_ids)
+
+    return np.where(choose_left, left, right)
 
-    return annotations_by_frame[nearest_frame_id]
+def find_nearest_annotations(frame_id, annotations_by_frame):
+    """
+    Finds the nearest annotations for a given frame_id using binary search over the sorted frame ids.
+
+    Args:
+        frame_id (int): The frame ID for which to retrieve annotations.
+        annotations_by_frame (AnnotationIndex): Annotations organized by frame_id.
+
+    Returns:
+        dict: The nearest annotations for the given frame_id.
+    """
+    pos = find_nearest_annotation_positions([frame_id], annotations_by_frame)[0]
+    return annotations_by_frame.frame(int(pos))
 
 
 def scale_mask_coords(mask_coords, expected_shape, actual_shape):
@@ -129,63 +307,133 @@ def scale_mask_coords(mask_coords, expected_shape, actual_shape):
         actual_shape: Actual shape of the image (height, width).
 
     Returns:
-        Scaled mask coordinates as a NumPy array.
+        Scaled mask coordinates as an int32 NumPy array.
     """
-    height_scale = actual_shape[0] / expected_shape[0]
-    width_scale = actual_shape[1] / expected_shape[1]
-    scaled_coords = np.array([[int(x * width_scale), int(y * height_scale)] for x, y in mask_coords])
-    return scaled_coords
+    return scale_polygons(np.asarray(mask_coords).reshape(-1, 2), expected_shape, actual_shape)
 
 def calculate_bounding_rectangle(coordinates):
     """
-    Calculates the bounding rectangle that encompasses a set of coordinates.
+    Calculates the minimum-area rectangle that encompasses a set of coordinates.
 
     Args:
-        coordinates: A list of lists representing [x, y] coordinates.
+        coordinates: A list of lists or an (N, 2) array representing [x, y] coordinates.
 
     Returns:
-        A list of lists representing the four corner points of the bounding rectangle:
-        [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]].
+        A (4, 2) int32 array with the four corner points of the bounding rectangle.
     """
-    points = np.array(coordinates, dtype=np.int32)
-    rect = cv2.minAreaRect(points)
-    box = cv2.boxPoints(rect)
-    box = np.intp(box)
-    return box.tolist()
+    vertices, offsets = flatten_polygons([coordinates])
+    return min_area_rectangles(vertices, offsets)[0]
 
-def apply_occlusion(img, annotations, noun_class_colors, expected_shape=(1080, 1920, 3)):
+def segment_rectangles(annotations, shape, expected_shape=(1080, 1920, 3)):
     """
-    Applies occlusion to the image based on given annotations with distinct colors for each noun class.
+    Computes the bounding rectangles of every segment of an annotated frame in one batch.
+
+    Args:
+        annotations: Annotations of a frame, either from `AnnotationIndex.frame` or in the VISOR JSON layout.
+        shape: Shape of the image the rectangles are drawn on (height, width, channels).
+        expected_shape: Shape of the image the annotations were made on (height, width, channels).
+
+    Returns:
+        A (K, 4, 2) int32 array with the corner points of each rectangle.
+    """
+    if 'vertices' in annotations:
+        vertices, offsets = annotations['vertices'], annotations['segment_offsets']
+    else:
+        vertices, offsets = flatten_polygons(
+            [segment for annotation in annotations['annotations'] for segment in annotation['segments']]
+        )
+
+    if shape != expected_shape:
+        vertices = scale_polygons(vertices, expected_shape[:2], shape[:2])
+
+    return min_area_rectangles(vertices, offsets)
+
+def rasterize_occlusion_mask(annotations, shape, expected_shape=(1080, 1920, 3)):
+    """
+    Rasterizes the bounding rectangles of all annotated segments into a boolean mask.
 
     Args:
-        img: Original image.
         annotations: Annotations to use for occlusion.
-        noun_class_colors: Dictionary mapping noun classes to colors.
-        expected_shape: Expected shape of the image (height, width, channels).
-    
+        shape: Shape of the image the mask is applied to (height, width, channels).
+        expected_shape: Shape of the image the annotations were made on (height, width, channels).
+
+    Returns:
+        A boolean array of shape (height, width) that is True where the image is occluded.
+    """
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    fill_rectangles(mask, segment_rectangles(annotations, shape, expected_shape), 1)
+    return mask.view(bool)
+
+@functools.lru_cache(maxsize=8)
+def solid_color_image(shape, color):
+    """
+    Returns a read-only uint8 image of the given shape filled with `color`.
+
+    Filling a full frame with a per-channel color is slow in NumPy, so the image is
+    built once per (shape, color) and reused.
+    """
+    image = np.empty(shape, dtype=np.uint8)
+    image[...] = color
+    image.flags.writeable = False
+    return image
+
+def apply_occlusion_mask(img, mask, mask_color=(0, 0, 0)):
+    """
+    Paints the occluded pixels of the image with `mask_color`.
+
+    Args:
+        img: Original image.
+        mask: Boolean mask of shape (height, width), e.g. from `rasterize_occlusion_mask`.
+        mask_color: Color of the occlusion (BGR format).
+
     Returns:
         The occluded image.
     """
-    if img.shape != expected_shape:
-        actual_shape = img.shape[:2]
+    occluded = img.copy()
+    # cv2.copyTo with a uint8 mask is much faster than NumPy's broadcast `where`
+    cv2.copyTo(solid_color_image(img.shape, tuple(mask_color)), mask.view(np.uint8), occluded)
+    return occluded
+
+def apply_occlusion_mask_stack(frames, mask, mask_color=(0, 0, 0), out=None):
+    """
+    Paints the same occluded pixels of every frame in a (T, H, W, C) stack with `mask_color`.
 
-    mask = img.copy()
+    Args:
+        frames: uint8 frame stack.
+        mask: Boolean mask of shape (height, width), e.g. from `rasterize_occlusion_mask`.
+        mask_color: Color of the occlusion (BGR format).
+        out: Optional stack of the same shape to write to, which may be `frames` itself.
 
-    for annotation in annotations['annotations']:
-        noun_class = annotation['class_id']
+    Returns:
+        The occluded frames.
+    """
+    if out is None:
+        out = frames.copy()
+    elif out is not frames:
+        np.copyto(out, frames)
 
-        # mask_color = noun_class_colors[noun_class]
-        mask_color = (0, 0, 0)
-        segments = annotation['segments']
-        
-        if img.shape != expected_shape:
-            segments = [scale_mask_coords(segment, expected_shape[:2], actual_shape) for segment in segments]
+    color = solid_color_image(frames.shape[1:], tuple(mask_color))
+    mask = mask.view(np.uint8)
+    for frame in out:
+        cv2.copyTo(color, mask, frame)
+    return out
 
-        for segment in segments:
-            mask_coords = calculate_bounding_rectangle(segment)
-            mask = cv2.fillPoly(mask, [np.array(mask_coords, dtype=np.int32)], mask_color)
+def apply_occlusion(img, annotations, noun_class_colors, expected_shape=(1080, 1920, 3)):
+    """
+    Applies occlusion to the image based on given annotations.
 
-    return mask
+    Args:
+        img: Original image.
+        annotations: Annotations to use for occlusion.
+        noun_class_colors: Dictionary mapping noun classes to colors (currently unused, every
+                           occlusion is painted black).
+        expected_shape: Expected shape of the image (height, width, channels).
+    
+    Returns:
+        The occluded image.
+    """
+    mask = rasterize_occlusion_mask(annotations, img.shape, expected_shape)
+    return apply_occlusion_mask(img, mask)
 
 def overlay_mask(image, segments, mask_color=(0, 0, 255), expected_shape=(1080, 1920, 3)):
     """
@@ -200,19 +448,12 @@ def overlay_mask(image, segments, mask_color=(0, 0, 255), expected_shape=(1080,
     Returns:
         The masked image.
     """
-    if image.shape != expected_shape:
-        actual_shape = image.shape[:2]
+    vertices, offsets = flatten_polygons(segments)
 
-    mask = image.copy()
-
-    for mask_coords in segments:
-        if image.shape != expected_shape:
-            mask_coords = scale_mask_coords(mask_coords, expected_shape[:2], actual_shape)
-
-        mask_coords = calculate_bounding_rectangle(mask_coords)
-        mask = cv2.fillPoly(mask, [np.array(mask_coords, dtype=np.int32)], mask_color)
+    if image.shape != expected_shape:
+        vertices = scale_polygons(vertices, expected_shape[:2], image.shape[:2])
 
-    return mask
+    return fill_rectangles(image.copy(), min_area_rectangles(vertices, offsets), mask_color)
 
 # annotations_by_frame = load_annotations('../P01_01.json')
 # print(find_nearest_annotations(93349, annotations_by_frame))
\ No newline at end of file
@@ -0,0 +1,394 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import importlib.util
+import subprocess as sp
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import cv2
+
+from memory import MemoryTracker
+from video_io import StreamingVideoWriter, iter_frame_windows
+from quality_score import QUALITY_DIMENSIONS
+from photometric import DEFAULT_DARKEN_GAMMA
+from degradations import DEFAULT_BLUR_LENGTH, DEFAULT_BLUR_ANGLE, DEFAULT_SHAKE_AMPLITUDE, DEFAULT_SHAKE_ROTATION, DEFAULT_NOISE_SIGMA
+
+# Resolution of the clips in processed_videos/clipped_resized_videos
+CLIP_WIDTH, CLIP_HEIGHT, CLIP_FPS = 576, 324, 60
+
+# VISOR polygons are annotated on the full resolution frames
+VISOR_WIDTH, VISOR_HEIGHT = 1920, 1080
+
+AUGMENT_TYPES = ['darken', 'completeness', 'occlusion']
+# Augmentations that are only benchmarked when requested, like they are only planned when requested
+EXTRA_AUGMENT_TYPES = ['motion_blur', 'camera_shake', 'sensor_noise']
+
+def load_augment_cli():
+    # augment-cli.py is not importable by name because of the hyphen. It is registered
+    # in sys.modules so its functions can be pickled into (forked) pool workers
+    spec = importlib.util.spec_from_file_location('augment_cli', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'augment-cli.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def make_synthetic_clip(path, frame_count, width=CLIP_WIDTH, height=CLIP_HEIGHT, fps=CLIP_FPS, seed=0):
+    """
+    Encodes a clip of moving gradients and noise, so the encoder cannot skip frames.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.arange(width, dtype=np.int32)[None, :]
+    y = np.arange(height, dtype=np.int32)[:, None]
+
+    writer = StreamingVideoWriter(path, fps)
+    try:
+        for i in range(frame_count):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[..., 0] = (x + 3 * i) % 256
+            frame[..., 1] = (y + 2 * i) % 256
+            frame[..., 2] = rng.integers(0, 256, size=(height, width), dtype=np.uint8)
+            writer.write(frame)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+def make_synthetic_annotations(path, video_id, frame_ids, seed=0, max_objects=4, max_vertices=40):
+    """
+    Writes a VISOR-style annotation file with random polygons on `frame_ids`.
+    """
+    rng = random.Random(seed)
+    video_annotations = []
+    for frame_id in frame_ids:
+        objects = []
+        for _ in range(rng.randint(0, max_objects)):
+            segments = [
+                [[rng.uniform(0, VISOR_WIDTH), rng.uniform(0, VISOR_HEIGHT)] for _ in range(rng.randint(3, max_vertices))]
+                for _ in range(rng.randint(1, 3))
+            ]
+            objects.append({'name': 'object', 'class_id': rng.randint(0, 299), 'segments': segments})
+        video_annotations.append({
+            'image': {'name': f"{video_id}_frame_{frame_id:010d}.jpg", 'image_path': f"{video_id}/{video_id}_frame_{frame_id:010d}.jpg"},
+            'annotations': objects,
+        })
+
+    with open(path, 'w') as f:
+        json.dump({'video_annotations': video_annotations}, f)
+
+def make_synthetic_dataset(work_dir, lengths, clips_per_length=2, annotation_interval=30, seed=0):
+    """
+    Generates clips, VISOR annotations and an annotations CSV laid out like the real dataset.
+
+    Every clip length gets its own video_id, with `clips_per_length` narrations.
+
+    Returns:
+        pd.DataFrame: The annotations CSV rows.
+    """
+    roots = dataset_roots(work_dir)
+    clips_dir, annotations_dir = roots['source_clips_root'], roots['annotations_root']
+    os.makedirs(clips_dir, exist_ok=True)
+    os.makedirs(annotations_dir, exist_ok=True)
+
+    rows = []
+    for video_index, frame_count in enumerate(lengths):
+        video_id = f"P90_{video_index + 1:02d}"
+        for clip_index in range(clips_per_length):
+            start_frame = 1000 + clip_index * (frame_count + 1000)
+            narration_id = f"{video_id}_{clip_index}"
+            make_synthetic_clip(os.path.join(clips_dir, f"{narration_id}.mp4"), frame_count, seed=seed + len(rows))
+            rows.append({
+                'narration_id': narration_id,
+                'participant_id': 'P90',
+                'video_id': video_id,
+                'narration_timestamp': '00:00:00.000',
+                'start_timestamp': '00:00:00.000',
+                'stop_timestamp': '00:00:00.000',
+                'start_frame': start_frame,
+                'stop_frame': start_frame + frame_count,
+                'narration': f'take object {clip_index}',
+                'verb': 'take',
+                'verb_class': 0,
+                'noun': 'object',
+                # Negatives are sampled from other (noun_class, verb_class) groups
+                'noun_class': len(rows),
+                'all_nouns': "['object']",
+                'all_noun_classes': f"[{len(rows)}]",
+                'action_presence': 1,
+                **{dimension: 4.0 for dimension in QUALITY_DIMENSIONS},
+            })
+
+        stop_frame = rows[-1]['stop_frame']
+        make_synthetic_annotations(
+            os.path.join(annotations_dir, f"{video_id}.json"), video_id,
+            range(1, stop_frame + annotation_interval, annotation_interval), seed=seed + video_index,
+        )
+
+    return pd.DataFrame(rows)
+
+def dataset_roots(work_dir):
+    """
+    Directories of the synthetic clips and annotations, passed to the pipeline
+    explicitly so pool workers find them whatever the start method.
+
+    Returns:
+        dict: `annotations_root`, `compiled_root` and `source_clips_root` keyword arguments.
+    """
+    return {
+        'annotations_root': os.path.join(work_dir, 'visor-annotations'),
+        'compiled_root': os.path.join(work_dir, 'visor-annotations-compiled'),
+        'source_clips_root': os.path.join(work_dir, 'processed_videos', 'clipped_resized_videos'),
+    }
+
+def plan_row(record, augment_type, segment_id):
+    frame_count = record['stop_frame'] - record['start_frame']
+    params = {
+        'completeness': {'level': 0.5, 'frame_count': int(min(frame_count // 2, 60 * 3))},
+        'darken': {'gamma': DEFAULT_DARKEN_GAMMA},
+        'motion_blur': {'length': DEFAULT_BLUR_LENGTH, 'angle': DEFAULT_BLUR_ANGLE},
+        'camera_shake': {'amplitude': DEFAULT_SHAKE_AMPLITUDE, 'rotation': DEFAULT_SHAKE_ROTATION, 'seed': 0},
+        'sensor_noise': {'sigma': DEFAULT_NOISE_SIGMA, 'seed': 0},
+    }.get(augment_type, {})
+    return {
+        'segment_id': segment_id,
+        'narration_id': record['narration_id'],
+        'participant_id': record['participant_id'],
+        'video_id': record['video_id'],
+        'start_frame': record['start_frame'],
+        'stop_frame': record['stop_frame'],
+        'narration': record['narration'],
+        'augment_type': augment_type,
+        'augment_params': params,
+    }
+
+def reset_caches(augment_cli, roots):
+    # Every measurement starts with cold annotation and mask caches
+    augment_cli.annotations = None
+    augment_cli.init_worker(**roots)
+
+def result(benchmark, augment_type, clip_frames, frames, seconds, peak_rss_mb, **extra):
+    return dict({
+        'benchmark': benchmark,
+        'augment_type': augment_type,
+        'clip_frames': clip_frames,
+        'frames': int(frames),
+        'seconds': round(seconds, 6),
+        'frames_per_second': round(frames / seconds, 2) if seconds else None,
+        'peak_rss_mb': peak_rss_mb,
+    }, **extra)
+
+def benchmark_augment(augment_cli, roots, record, augment_type, window_size=64, repeat=3):
+    """
+    Measures the augment stage alone: one window of the clip is decoded up front
+    and replayed for the length of the clip, so decoding and encoding are excluded.
+    """
+    from decord import VideoReader, cpu
+
+    vr = VideoReader(augment_cli.narration_clip_path(record['narration_id'], roots['source_clips_root']), ctx=cpu(0))
+    frame_count = len(vr) - 1
+    _, window = next(iter_frame_windows(vr, min(frame_count, window_size), window_size))
+    del vr
+
+    row = plan_row(record, augment_type, f"{record['narration_id']}_bench")
+    best = None
+    for _ in range(repeat):
+        reset_caches(augment_cli, roots)
+        frames = 0
+        with MemoryTracker() as tracker:
+            start = time.perf_counter()
+            segment = augment_cli.prepare_segment(row, frame_count)
+            for window_start in range(0, frame_count, window_size):
+                window_indices = np.arange(window_start, min(window_start + window_size, frame_count))
+                # Not in place, the window is replayed
+                frames += len(augment_cli.augment_window(segment, window_indices, window[:len(window_indices)]))
+            seconds = time.perf_counter() - start
+
+        # Throughput is per source frame, like the augment stage in `report`
+        measured = result('augment', augment_type, frame_count, frame_count, seconds, tracker.record['peak_rss_mb'], frames_written=frames)
+        if best is None or measured['seconds'] < best['seconds']:
+            best = measured
+    return best
+
+def benchmark_segment(augment_cli, roots, record, augment_type, output_dir, window_size=64, repeat=3):
+    """
+    Measures `process_segment` end to end: decode, augment, encode and write.
+    """
+    best = None
+    for _ in range(repeat):
+        reset_caches(augment_cli, roots)
+        row = plan_row(record, augment_type, f"{record['narration_id']}_{augment_type}")
+        with MemoryTracker() as tracker:
+            start = time.perf_counter()
+            augment_cli.process_segment(output_dir, row, window_size=window_size)
+            seconds = time.perf_counter() - start
+
+        stages = {f'{stage}_s': row[f'{stage}_s'] for stage in augment_cli.STAGES}
+        measured = result('segment', augment_type, row['frames'], row['frames'], seconds, tracker.record['peak_rss_mb'], frames_written=row['frames_written'], **stages)
+        if best is None or measured['seconds'] < best['seconds']:
+            best = measured
+    return best
+
+def benchmark_process_plan(augment_cli, roots, labels, run_dir, workers=1, window_size=64):
+    """
+    Measures `generate-plan` followed by `process-plan` on the synthetic annotations CSV.
+    """
+    csv_path = os.path.join(run_dir, 'labels.csv')
+    plan_path = os.path.join(run_dir, 'plan.csv')
+    progress_path = os.path.join(run_dir, 'progress.csv')
+    labels.to_csv(csv_path, index=False)
+
+    augment_cli.generate_augmentation_plan(csv_path, os.path.dirname(run_dir), plan_path, os.path.join(run_dir, 'segments.csv'), seed=0, annotations_root=roots['annotations_root'], compiled_root=roots['compiled_root'])
+
+    start = time.perf_counter()
+    augment_cli.process_augmentation_plan(plan_path, os.path.join(run_dir, 'generated'), progress_path, workers=workers, window_size=window_size, **roots)
+    seconds = time.perf_counter() - start
+
+    progress_data = pd.read_csv(progress_path)
+    rendered = progress_data.dropna(subset=['frames'])
+    failed = int((~progress_data['status'].isin(['completed'])).sum())
+
+    # Workers record their own peaks; RUSAGE_CHILDREN covers workers that exited
+    children_peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    peak_rss_mb = round(max(rendered['peak_rss_mb'].max() if 'peak_rss_mb' in rendered else 0, children_peak_mb), 1)
+
+    return result(
+        'process_plan', 'all', int(labels.eval('stop_frame - start_frame').max()), rendered['frames'].sum(), seconds, peak_rss_mb,
+        frames_written=int(rendered['frames_written'].sum()), segments=len(rendered), failed=failed, workers=workers,
+    )
+
+def git_revision():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = sp.run(['git', 'rev-parse', 'HEAD'], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(sp.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, sp.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def run_benchmarks(lengths, clips_per_length=2, augment_types=AUGMENT_TYPES, repeat=3, workers=1, window_size=64, work_dir=None, skip_process_plan=False):
+    """
+    Runs every benchmark on a freshly generated synthetic dataset.
+
+    Returns:
+        dict: Environment, parameters and one result per benchmark, augment type and clip length.
+    """
+    augment_cli = load_augment_cli()
+    keep_work_dir = work_dir is not None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='augment-benchmark-'))
+
+    try:
+        print(f"Generating synthetic clips of {', '.join(map(str, lengths))} frames in {work_dir}")
+        labels = make_synthetic_dataset(work_dir, lengths, clips_per_length)
+
+        roots = dataset_roots(work_dir)
+        run_dir = os.path.join(work_dir, 'run')
+        os.makedirs(run_dir, exist_ok=True)
+
+        results = []
+        # One clip per length; the others only add rows to the plan
+        for record in labels.groupby('video_id').head(1).to_dict('records'):
+            for augment_type in augment_types:
+                for measured in [
+                    benchmark_augment(augment_cli, roots, record, augment_type, window_size, repeat),
+                    benchmark_segment(augment_cli, roots, record, augment_type, os.path.join(run_dir, 'segments'), window_size, repeat),
+                ]:
+                    print(f"{measured['benchmark']:>8} {augment_type:<12} {measured['clip_frames']:>5} frames: "
+                          f"{measured['frames_per_second']:>9.1f} frames/s, peak {measured['peak_rss_mb']:.0f} MB")
+                    results.append(measured)
+
+        if not skip_process_plan:
+            measured = benchmark_process_plan(augment_cli, roots, labels, run_dir, workers, window_size)
+            print(f"process-plan: {measured['segments']} segments, {measured['frames_per_second']:.1f} frames/s, peak {measured['peak_rss_mb']:.0f} MB")
+            results.append(measured)
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit, dirty = git_revision()
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {
+            'lengths': list(lengths),
+            'clips_per_length': clips_per_length,
+            'resolution': [CLIP_WIDTH, CLIP_HEIGHT],
+            'repeat': repeat,
+            'workers': workers,
+            'window_size': window_size,
+        },
+        'results': results,
+    }
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compares two benchmark result files.
+
+    A benchmark regressed if its frames/s dropped, or its peak memory grew, by
+    more than `threshold` (a fraction) relative to the baseline.
+
+    Returns:
+        tuple: A DataFrame with both measurements per benchmark, and the regressed rows.
+    """
+    key = ['benchmark', 'augment_type', 'clip_frames']
+    columns = key + ['frames_per_second', 'peak_rss_mb']
+    merged = pd.DataFrame(baseline['results'])[columns].merge(
+        pd.DataFrame(current['results'])[columns], on=key, suffixes=('_baseline', '_current'),
+    )
+    merged['speedup'] = merged['frames_per_second_current'] / merged['frames_per_second_baseline']
+    merged['memory_ratio'] = merged['peak_rss_mb_current'] / merged['peak_rss_mb_baseline']
+
+    regressed = merged[(merged['speedup'] < 1 - threshold) | (merged['memory_ratio'] > 1 + threshold)]
+    return merged, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the augmentation pipeline on synthetic 324p clips and VISOR annotations.")
+    parser.add_argument('--output', type=str, default='benchmark-results.json', help="Path to save the results as JSON.")
+    parser.add_argument('--lengths', type=int, nargs='+', default=[60, 240, 960], help="Clip lengths in frames.")
+    parser.add_argument('--clips-per-length', type=int, default=2, help="Number of clips of every length in the process-plan benchmark.")
+    parser.add_argument('--augment-types', type=str, nargs='+', default=AUGMENT_TYPES, choices=AUGMENT_TYPES + EXTRA_AUGMENT_TYPES, help="Augmentations to benchmark.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of every benchmark; the fastest is kept.")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes of the process-plan benchmark.")
+    parser.add_argument('--window-size', type=int, default=64, help="Frames decoded and augmented at a time.")
+    parser.add_argument('--work-dir', type=str, help="Directory to generate the synthetic dataset in and keep afterwards. Defaults to a temporary directory.")
+    parser.add_argument('--skip-process-plan', action='store_true', help="Only run the per-augmentation benchmarks.")
+    parser.add_argument('--compare', type=str, help="Results of an earlier run to compare against; exits with status 1 on a regression.")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown or memory growth reported as a regression.")
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.lengths, args.clips_per_length, args.augment_types, args.repeat, args.workers,
+        args.window_size, args.work_dir, args.skip_process_plan,
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        merged, regressed = compare_results(baseline, results, args.threshold)
+        print(f"\nCompared with {baseline.get('commit') or args.compare}:")
+        print(merged.to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+        if not regressed.empty:
+            print(f"\n{len(regressed)} benchmarks regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
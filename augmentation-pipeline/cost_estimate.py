@@ -0,0 +1,186 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pandas as pd
+
+def probe_clip(path):
+    """
+    Reads the frame count, frame size and frame rate of a video from its container header, without decoding.
+
+    Returns:
+        dict: `frames`, `width`, `height` and `fps`, or None if the video cannot be opened.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        return {
+            # The pipeline drops the last frame, see `process_narration_segments`
+            'frames': max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) - 1, 0),
+            'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': capture.get(cv2.CAP_PROP_FPS),
+        }
+    finally:
+        capture.release()
+
+def probe_clips(paths, threads=16):
+    """
+    Probes many videos concurrently; opening a video is mostly waiting on the filesystem.
+
+    Returns:
+        list: `probe_clip` results, in the order of `paths`.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(probe_clip, paths))
+
+def expected_frames_written(augment_type, params, frames):
+    """
+    Returns the number of frames a plan row renders from a source clip of `frames` frames.
+    """
+    if augment_type == 'negative':
+        return 0
+    if 'operators' in params:
+        # A composite writes what is left after every operator
+        return min(expected_frames_written(operator['type'], operator.get('params') or {}, frames) for operator in params['operators'])
+    if 'frame_count' in params:
+        # Completeness keeps frames 0 to frame_count
+        return min(frames, params['frame_count'] + 1)
+    return frames
+
+class ThroughputModel:
+    """
+    Per-augmentation cost coefficients calibrated from the stage timings of a sample run.
+
+    Costs are proportional to the megapixels processed:
+
+        seconds = decode_s_per_mp * decoded_mp                                  (once per source clip)
+                + augment_s_per_mp[augment_type] * source_mp                    (per segment)
+                + output_s_per_mp[augment_type] * written_mp                    (per segment)
+        bytes   = bytes_per_mp[augment_type] * written_mp
+
+    where `source_mp` is the clip's frames times its frame size in megapixels,
+    `decoded_mp` the same for the frames any segment of the clip needs, and
+    `written_mp` for the frames written to the segment. Opening the clip is
+    counted with decoding, encoding with writing.
+    """
+
+    def __init__(self, decode_s_per_mp, augment_s_per_mp, output_s_per_mp, bytes_per_mp, samples):
+        self.decode_s_per_mp = decode_s_per_mp
+        self.augment_s_per_mp = augment_s_per_mp
+        self.output_s_per_mp = output_s_per_mp
+        self.bytes_per_mp = bytes_per_mp
+        self.samples = samples
+
+    @classmethod
+    def from_progress(cls, progress_data):
+        """
+        Fits the coefficients to the progress records of a run with stage timings.
+
+        Raises:
+            ValueError: If no rendered segment has stage timings.
+        """
+        if 'frames' not in progress_data:
+            raise ValueError("The progress has no stage timings, calibrate with a run of this version of process-plan")
+
+        timed = progress_data.dropna(subset=['frames', 'frame_width', 'frame_height'])
+        timed = timed[timed['frames'] > 0]
+        if timed.empty:
+            raise ValueError("The progress has no rendered segments with stage timings")
+
+        megapixels = timed['frame_width'] * timed['frame_height'] / 1e6
+        # Runs before operators declared their frames decoded every frame
+        frames_decoded = timed['frames_decoded'].fillna(timed['frames']) if 'frames_decoded' in timed else timed['frames']
+        timed = timed.assign(
+            source_mp=timed['frames'] * megapixels,
+            decoded_mp=frames_decoded * megapixels,
+            written_mp=timed['frames_written'] * megapixels,
+            shared_s=timed['open_s'] + timed['decode_s'],
+            output_s=timed['encode_s'] + timed['write_s'],
+        )
+
+        # Shared stages are split between the segments of a clip, but the clip is decoded once
+        decode_s_per_mp = timed['shared_s'].sum() / timed.drop_duplicates(subset='narration_id')['decoded_mp'].sum()
+
+        by_type = timed.groupby(timed['augment_type'].astype(str))
+        augment_s_per_mp = (by_type['augment_s'].sum() / by_type['source_mp'].sum()).to_dict()
+        output_s_per_mp = (by_type['output_s'].sum() / by_type['written_mp'].sum()).to_dict()
+        bytes_per_mp = {}
+        if 'bytes_written' in timed:
+            bytes_per_mp = (by_type['bytes_written'].sum(min_count=1) / by_type['written_mp'].sum()).dropna().to_dict()
+
+        return cls(decode_s_per_mp, augment_s_per_mp, output_s_per_mp, bytes_per_mp, by_type.size().to_dict())
+
+    def coefficient(self, coefficients, augment_type, combine=np.sum):
+        if augment_type in coefficients:
+            return coefficients[augment_type]
+        # Composites missing from the sample combine the coefficients of their operators
+        parts = augment_type.split('+')
+        if len(parts) > 1 and all(part in coefficients for part in parts):
+            return float(combine([coefficients[part] for part in parts]))
+        # Other augmentations are costed like an average one
+        return float(np.mean(list(coefficients.values()))) if coefficients else np.nan
+
+def estimate_plan_cost(plan_data, clips, model):
+    """
+    Estimates the processing time and output size of every plan row.
+
+    Args:
+        plan_data (pd.DataFrame): Plan rows with parsed `augment_params`.
+        clips (pd.DataFrame): `frames`, `width` and `height` of every source clip, indexed by narration_id.
+        model (ThroughputModel): Calibrated coefficients.
+
+    Returns:
+        pd.DataFrame: The plan rows with `frames`, `frames_written`, `seconds` and `bytes`. The
+                      decode time of a clip, also in `decode_seconds`, is assigned to its
+                      first rendered segment.
+    """
+    estimate = plan_data[['segment_id', 'narration_id', 'video_id', 'augment_type']].copy()
+    estimate['augment_type'] = estimate['augment_type'].astype(str)
+    clip_info = clips.reindex(estimate['narration_id'])
+    estimate['frames'] = clip_info['frames'].to_numpy()
+    megapixels = (clip_info['width'] * clip_info['height']).to_numpy() / 1e6
+
+    estimate['frames_written'] = [
+        expected_frames_written(augment_type, params, frames)
+        for augment_type, params, frames in zip(estimate['augment_type'], plan_data['augment_params'], estimate['frames'])
+    ]
+
+    augment_types = estimate['augment_type']
+    rendered = (augment_types != 'negative').to_numpy()
+    source_mp = estimate['frames'].to_numpy() * megapixels
+    written_mp = estimate['frames_written'].to_numpy() * megapixels
+
+    first_rendered = rendered & ~pd.Series(estimate['narration_id'].where(rendered)).duplicated().to_numpy()
+    # Every operator reads the frames it writes, so a clip decodes the most frames any of its segments writes
+    decoded_mp = estimate['frames_written'].where(rendered).groupby(estimate['narration_id'], observed=True).transform('max').to_numpy() * megapixels
+    estimate['decode_seconds'] = np.where(first_rendered, model.decode_s_per_mp * decoded_mp, 0)
+    seconds = (
+        estimate['decode_seconds'].to_numpy()
+        + np.where(rendered, augment_types.map(lambda name: model.coefficient(model.augment_s_per_mp, name)).to_numpy() * source_mp, 0)
+        # A composite is encoded once, so its output costs about as much as one of its operators'
+        + np.where(rendered, augment_types.map(lambda name: model.coefficient(model.output_s_per_mp, name, np.mean)).to_numpy() * written_mp, 0)
+    )
+    estimate['seconds'] = seconds
+    estimate['bytes'] = np.where(rendered, augment_types.map(lambda name: model.coefficient(model.bytes_per_mp, name, np.mean)).to_numpy() * written_mp, 0)
+    return estimate
+
+def wall_clock_seconds(estimate, workers, schedule='video'):
+    """
+    Estimates the wall-clock time of processing `estimate` with `workers` workers.
+
+    Tasks are assumed to be balanced over the workers, except that no run can be
+    shorter than its largest task (a video or a source clip, see `--schedule`).
+    """
+    group = {'video': 'video_id', 'narration': 'narration_id', 'segment': 'segment_id'}[schedule]
+    total = estimate['seconds'].sum()
+    largest_task = estimate.groupby(group, observed=True)['seconds'].sum().max() if len(estimate) else 0
+    return max(total / workers, largest_task)
+
+def format_duration(seconds):
+    if not math.isfinite(seconds):
+        return "unknown"
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
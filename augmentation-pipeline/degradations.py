@@ -0,0 +1,197 @@
+import functools
+import cv2
+import numpy as np
+
+# Default severities of the camera degradations, overridden by the plan's augment_params
+DEFAULT_BLUR_LENGTH = 15
+DEFAULT_BLUR_ANGLE = 0.0
+DEFAULT_SHAKE_AMPLITUDE = 0.02
+DEFAULT_SHAKE_ROTATION = 0.0
+DEFAULT_SHAKE_SMOOTHNESS = 0.9
+DEFAULT_NOISE_SIGMA = 12.0
+
+def motion_blur_stack(frames, length=DEFAULT_BLUR_LENGTH, angle=DEFAULT_BLUR_ANGLE, out=None):
+    """
+    Blurs every frame of a (T, H, W, C) stack along a line of `length` pixels at `angle` degrees.
+
+    A horizontal line is a box filter along the rows, applied to the whole stack
+    at once. Other angles are reduced to it with a shear: every column is shifted
+    by an integer number of rows so the line becomes horizontal, box-filtered and
+    shifted back, which is much faster than convolving with a rotated line kernel.
+
+    Args:
+        frames (np.ndarray): uint8 frame stack.
+        length (int): Length of the blur in pixels.
+        angle (float): Direction of the motion in degrees, counter-clockwise from horizontal.
+        out (np.ndarray): Optional stack to write to, which may be `frames` itself.
+
+    Returns:
+        np.ndarray: The blurred frames.
+    """
+    if out is None:
+        out = np.empty_like(frames)
+    if len(frames) == 0 or length <= 1:
+        np.copyto(out, frames)
+        return out
+
+    # Image rows go down, so counter-clockwise is a negative angle in pixel coordinates
+    angle = (-angle + 90) % 180 - 90
+    length = int(round(length))
+
+    if angle == 0 and frames.flags.c_contiguous and out.flags.c_contiguous:
+        # Rows of the stack never mix frames, so one call blurs the whole stack
+        rows = frames.reshape(-1, *frames.shape[2:])
+        cv2.blur(rows, (length, 1), dst=out.reshape(-1, *frames.shape[2:]), borderType=cv2.BORDER_REPLICATE)
+        return out
+    if angle in (0, -90):
+        kernel = (length, 1) if angle == 0 else (1, length)
+        for frame, target in zip(frames, out):
+            cv2.blur(frame, kernel, dst=target, borderType=cv2.BORDER_REPLICATE)
+        return out
+
+    transposed = abs(angle) > 45
+    if transposed:
+        # Steep lines are sheared from vertical, on the transposed frames
+        frames = frames.swapaxes(1, 2)
+        out = out.swapaxes(1, 2)
+        angle = 90 - angle if angle > 0 else -90 - angle
+
+    height, width = frames.shape[1:3]
+    slope = np.tan(np.deg2rad(angle))
+    kernel_width = max(1, int(round(length * np.cos(np.deg2rad(angle)))))
+
+    # Image y - x * slope (plus a margin to keep every pixel) holds the pixels of a line on one row
+    margin = int(np.ceil(width * abs(slope)))
+    shear = np.array([[1, 0, 0], [-slope, 1, margin if slope > 0 else 0]], dtype=np.float32)
+    for frame, target in zip(frames, out):
+        frame = np.ascontiguousarray(frame)
+        sheared = cv2.warpAffine(frame, shear, (width, height + margin), flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_REPLICATE)
+        cv2.blur(sheared, (kernel_width, 1), dst=sheared, borderType=cv2.BORDER_REPLICATE)
+        unsheared = cv2.warpAffine(sheared, shear, (width, height), flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP)
+        np.copyto(target, unsheared.reshape(target.shape))
+
+    return out.swapaxes(1, 2) if transposed else out
+
+def shake_trajectory(frame_count, amplitude=DEFAULT_SHAKE_AMPLITUDE, rotation=DEFAULT_SHAKE_ROTATION, smoothness=DEFAULT_SHAKE_SMOOTHNESS, seed=None):
+    """
+    Generates a camera shake as a seeded random walk of per-frame offsets.
+
+    Each of x, y and the rotation follows an AR(1) process, so the camera wanders
+    smoothly around its original position instead of drifting away.
+
+    Args:
+        frame_count (int): Number of frames.
+        amplitude (float): Standard deviation of the offsets, as a fraction of the frame width.
+        rotation (float): Standard deviation of the rotation in degrees.
+        smoothness (float): Correlation between consecutive frames, in [0, 1).
+        seed (int): Seed of the walk, so the same segment always shakes the same way.
+
+    Returns:
+        np.ndarray: A (frame_count, 3) array of x and y offsets (fractions of the width) and rotations (degrees).
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.standard_normal((frame_count, 3)) * np.array([amplitude, amplitude, rotation]) * np.sqrt(1 - smoothness ** 2)
+
+    trajectory = np.empty_like(steps)
+    position = rng.standard_normal(3) * np.array([amplitude, amplitude, rotation])
+    for i, step in enumerate(steps):
+        position = smoothness * position + step
+        trajectory[i] = position
+    return trajectory
+
+def shake_stack(frames, trajectory, bounds, out=None):
+    """
+    Warps every frame of a stack by its offsets and rotation from `shake_trajectory`.
+
+    The frames are zoomed in just enough to crop the borders exposed by the
+    largest offsets of the segment, `bounds`, so the zoom does not change between
+    windows. Without rotation, a shifted zoom is a crop resized to the frame size,
+    which is several times faster than a warp; offsets are then rounded to whole
+    source pixels. Corners exposed by a rotation are filled by reflection.
+
+    Args:
+        frames (np.ndarray): uint8 frame stack.
+        trajectory (np.ndarray): The rows of `shake_trajectory` for these frames.
+        bounds (tuple): Largest absolute x and y offsets of the whole segment.
+        out (np.ndarray): Optional stack to write to, not `frames` itself.
+
+    Returns:
+        np.ndarray: The shaken frames.
+    """
+    if out is None:
+        out = np.empty_like(frames)
+
+    height, width = frames.shape[1:3]
+    zoom = 1 + 2 * max(bounds[0], bounds[1] * width / height)
+    crop_width, crop_height = int(round(width / zoom)), int(round(height / zoom))
+    for frame, target, (dx, dy, degrees) in zip(frames, out, trajectory):
+        if degrees == 0:
+            # Top-left corner of the source region the zoomed, shifted frame shows
+            x = int(np.clip(round((width - crop_width) / 2 - dx * width / zoom), 0, width - crop_width))
+            y = int(np.clip(round((height - crop_height) / 2 - dy * width / zoom), 0, height - crop_height))
+            resized = cv2.resize(frame[y:y + crop_height, x:x + crop_width], (width, height), interpolation=cv2.INTER_LINEAR)
+            np.copyto(target, resized.reshape(target.shape))
+        else:
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), degrees, zoom)
+            matrix[:, 2] += (dx * width, dy * width)
+            cv2.warpAffine(frame, matrix, (width, height), dst=target, borderMode=cv2.BORDER_REFLECT101)
+    return out
+
+@functools.lru_cache(maxsize=4)
+def noise_bank(sigma, shape, size=16, margin=32):
+    """
+    Generates `size` frames of Gaussian noise of standard deviation `sigma`, `margin`
+    pixels larger than `shape`, split into the positive and negative parts so they
+    can be applied with saturating cv2.add and cv2.subtract.
+
+    The bank is shared by every segment of a worker with the same sigma and frame
+    size; generating it takes longer than augmenting a whole segment.
+
+    Returns:
+        tuple: Read-only `(positive, negative)` uint8 arrays of shape (size, H + margin, W + margin, C).
+    """
+    height, width, channels = shape
+    rng = np.random.default_rng(0)
+    noise = np.rint(rng.standard_normal((size, height + margin, width + margin, channels), dtype=np.float32) * sigma)
+    positive = np.clip(noise, 0, 255).astype(np.uint8)
+    negative = np.clip(-noise, 0, 255).astype(np.uint8)
+    positive.flags.writeable = False
+    negative.flags.writeable = False
+    return positive, negative
+
+class NoiseBank:
+    """
+    Gaussian sensor noise generated in bulk and reused for every frame of a segment.
+
+    Generating fresh noise for every pixel of every frame costs far more than any
+    other augmentation, so a few noise frames (with a margin) are generated once
+    with NumPy's Generator, see `noise_bank`. Each frame then gets a bank frame at
+    an offset drawn from the segment's seed, added with saturating uint8 arithmetic.
+    """
+
+    def __init__(self, sigma=DEFAULT_NOISE_SIGMA, size=16, margin=32, seed=None):
+        self.sigma = sigma
+        self.size = size
+        self.margin = margin
+        self.rng = np.random.default_rng(seed)
+
+    def choices(self, frame_count):
+        """
+        Draws the bank frame and offsets of every frame of the segment, so the noise of a frame does not depend on the windows.
+        """
+        return np.stack([
+            self.rng.integers(0, self.size, frame_count),
+            self.rng.integers(0, self.margin + 1, frame_count),
+            self.rng.integers(0, self.margin + 1, frame_count),
+        ], axis=1)
+
+    def apply(self, frames, choices, out=None):
+        if out is None:
+            out = np.empty_like(frames)
+        positive, negative = noise_bank(self.sigma, frames.shape[1:], self.size, self.margin)
+
+        height, width = frames.shape[1:3]
+        for frame, target, (k, dy, dx) in zip(frames, out, choices):
+            cv2.add(frame, positive[k, dy:dy + height, dx:dx + width], dst=target)
+            cv2.subtract(target, negative[k, dy:dy + height, dx:dx + width], dst=target)
+        return out
@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+def flatten_polygons(polygons):
+    """
+    Packs a list of polygons into one flat vertex array with offsets.
+
+    Args:
+        polygons: List of polygons, each a sequence of [x, y] coordinates.
+
+    Returns:
+        tuple: `(vertices, offsets)` where `vertices` is an (N, 2) array holding the
+               vertices of every polygon and polygon `i` spans `vertices[offsets[i]:offsets[i + 1]]`.
+    """
+    arrays = [np.asarray(polygon).reshape(-1, 2) for polygon in polygons]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(array) for array in arrays])
+
+    if not arrays:
+        return np.empty((0, 2), dtype=np.int32), offsets
+
+    return np.concatenate(arrays), offsets
+
+def scale_polygons(vertices, expected_shape, actual_shape):
+    """
+    Scales the vertices of every polygon from expected_shape to actual_shape in one broadcast.
+
+    Args:
+        vertices: (N, 2) array of [x, y] coordinates.
+        expected_shape: Shape of the image the coordinates refer to (height, width).
+        actual_shape: Shape of the image to scale the coordinates to (height, width).
+
+    Returns:
+        The scaled vertices as an (N, 2) int32 array, truncated like `int()`.
+    """
+    scale = np.array([actual_shape[1] / expected_shape[1], actual_shape[0] / expected_shape[0]])
+    return (vertices * scale).astype(np.int32)
+
+def min_area_rectangles(vertices, offsets):
+    """
+    Computes the minimum-area bounding rectangle of every polygon in one pass.
+
+    Args:
+        vertices: (N, 2) array of [x, y] coordinates, see `flatten_polygons`.
+        offsets: Polygon offsets into `vertices`.
+
+    Returns:
+        A (K, 4, 2) int32 array with the corner points of each rectangle, ready to
+        be passed to `cv2.fillPoly` without any conversion. Empty polygons are skipped.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype=np.int32)
+    boxes = [
+        cv2.boxPoints(cv2.minAreaRect(vertices[start:end]))
+        for start, end in zip(offsets[:-1], offsets[1:]) if end > start
+    ]
+
+    if not boxes:
+        return np.empty((0, 4, 2), dtype=np.int32)
+
+    # Truncate towards zero like `np.intp(box)` did
+    return np.array(boxes, dtype=np.float32).astype(np.int32)
+
+def fill_rectangles(mask, rectangles, color):
+    """
+    Fills each rectangle into the mask.
+
+    The rectangles are drawn one at a time because a single `cv2.fillPoly` call
+    with several contours leaves holes where they overlap.
+
+    Args:
+        mask: Image or mask to draw on, modified in place.
+        rectangles: (K, 4, 2) int32 array from `min_area_rectangles`.
+        color: Fill color.
+
+    Returns:
+        The mask.
+    """
+    for rectangle in rectangles:
+        cv2.fillPoly(mask, [rectangle], color)
+    return mask
@@ -0,0 +1,129 @@
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Pipeline stages timed for every segment, in processing order
+STAGES = ['open', 'decode', 'augment', 'encode', 'write']
+
+# Stages shared by every segment rendered from the same source clip
+SHARED_STAGES = ['open', 'decode']
+
+# Stages that only handle the frames written to the augmented segment
+OUTPUT_STAGES = ['encode', 'write']
+
+# Bucket edges of the per-stage histograms, in milliseconds per frame
+HISTOGRAM_EDGES_MS = [0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, np.inf]
+
+class StageTimer:
+    """
+    Accumulates wall-clock seconds per pipeline stage.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterator):
+        """
+        Yields the items of `iterator`, adding the time spent producing each one to `stage`.
+        """
+        iterator = iter(iterator)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(stage, time.perf_counter() - start)
+            yield item
+
+def segment_timings(shared_timer, segment_timer, segment_count):
+    """
+    Returns the `{stage}_s` progress fields of one segment.
+
+    The time of the shared stages, opening and decoding the source clip, is split
+    evenly between the `segment_count` segments rendered from it. Stage timings
+    measure the work done in each stage; decoding runs on the prefetch thread and
+    overlaps augmenting and encoding, so they can add up to more than the
+    wall-clock time of the task.
+    """
+    timings = {}
+    for stage in STAGES:
+        if stage in SHARED_STAGES:
+            seconds = shared_timer.seconds.get(stage, 0.0) / segment_count
+        else:
+            seconds = segment_timer.seconds.get(stage, 0.0)
+        timings[f'{stage}_s'] = round(seconds, 6)
+    return timings
+
+def stage_frames(timed, stage):
+    """
+    Returns the frames handled by `stage` for every segment: the frames written for
+    the output stages, the frames decoded for decode (runs before operators declared
+    their frames decoded every frame), and the source frames augmented otherwise.
+    """
+    if stage in OUTPUT_STAGES:
+        return timed['frames_written']
+    if stage == 'decode' and 'frames_decoded' in timed:
+        return timed['frames_decoded'].fillna(timed['frames'])
+    return timed['frames']
+
+def summarize_timings(progress_data):
+    """
+    Summarizes the recorded stage timings of a run.
+
+    Throughput is measured in segment frames per second, see `stage_frames`.
+
+    Args:
+        progress_data (pd.DataFrame): Progress records with `{stage}_s`, `frames` and `frames_written` columns.
+
+    Returns:
+        tuple: A DataFrame with seconds, frames and frames/s per stage, and one with
+               augment throughput per `augment_type`.
+    """
+    timed = progress_data.dropna(subset=['frames'])
+
+    stages = []
+    for stage in STAGES:
+        seconds = timed[f'{stage}_s'].sum()
+        frames = stage_frames(timed, stage).sum()
+        stages.append({'stage': stage, 'seconds': seconds, 'frames': int(frames), 'frames_per_second': frames / seconds if seconds else np.nan})
+
+    augment_types = timed.groupby('augment_type', observed=True).agg(
+        segments=('segment_id', 'size'), seconds=('augment_s', 'sum'), frames=('frames', 'sum'),
+    )
+    augment_types['frames_per_second'] = augment_types['frames'] / augment_types['seconds']
+
+    return pd.DataFrame(stages).set_index('stage'), augment_types
+
+def stage_histograms(progress_data, edges=HISTOGRAM_EDGES_MS):
+    """
+    Counts segments per bucket of milliseconds per frame, for every stage.
+
+    Returns:
+        pd.DataFrame: One row per bucket, one column per stage.
+    """
+    timed = progress_data.dropna(subset=['frames'])
+    labels = [f"{low:g}-{high:g}" if np.isfinite(high) else f">{low:g}" for low, high in zip(edges[:-1], edges[1:])]
+
+    histograms = {}
+    for stage in STAGES:
+        frames = stage_frames(timed, stage).to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ms_per_frame = timed[f'{stage}_s'].to_numpy(dtype=float) * 1000 / frames
+        counts, _ = np.histogram(ms_per_frame[np.isfinite(ms_per_frame)], bins=edges)
+        histograms[stage] = counts
+
+    return pd.DataFrame(histograms, index=pd.Index(labels, name='ms/frame'))
@@ -0,0 +1,109 @@
+import os
+from collections import OrderedDict
+import numpy as np
+
+class OcclusionMaskCache:
+    """
+    LRU cache of rasterized occlusion masks keyed by (video_id, annotated frame_id, output shape).
+
+    Masks are stored bit-packed, so a 324p mask costs ~23KB instead of ~187KB as a
+    boolean array. When the cache grows past `max_bytes` the least recently used
+    masks are evicted. If a `spill_dir` is given, every mask is also written there
+    as a `.npy` file and read back memory-mapped on a miss, which lets all pool
+    workers (and later runs) share the masks rasterized by any one of them.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Consecutive frames usually map to the same annotation, so keep the last
+        # mask unpacked to avoid unpacking it again for every frame
+        self.last_key = None
+        self.last_mask = None
+
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def spill_path(self, key):
+        video_id, frame_id, shape = key
+        return os.path.join(self.spill_dir, video_id, f"{frame_id}_{shape[0]}x{shape[1]}.npy")
+
+    def get(self, key):
+        """
+        Returns the boolean mask stored under `key`, or None if it is not cached.
+        """
+        if key == self.last_key:
+            self.hits += 1
+            return self.last_mask
+
+        packed = self.entries.get(key)
+        if packed is not None:
+            self.entries.move_to_end(key)
+        elif self.spill_dir is not None and os.path.exists(self.spill_path(key)):
+            packed = np.load(self.spill_path(key), mmap_mode='r')
+            self.store(key, packed)
+
+        if packed is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.unpack(key, packed)
+
+    def put(self, key, mask):
+        """
+        Stores a boolean mask of shape (height, width) under `key`.
+        """
+        packed = np.packbits(mask, axis=None)
+        self.store(key, packed)
+
+        if self.spill_dir is not None:
+            path = self.spill_path(key)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temporary file first so other workers never read a partial mask
+                tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+                np.save(tmp_path, packed)
+                os.replace(tmp_path, path)
+
+        self.last_key = key
+        self.last_mask = mask
+
+    def get_or_build(self, key, build_mask):
+        """
+        Returns the mask stored under `key`, rasterizing it with `build_mask()` on a miss.
+        """
+        mask = self.get(key)
+        if mask is None:
+            mask = build_mask()
+            self.put(key, mask)
+        return mask
+
+    def store(self, key, packed):
+        if key in self.entries:
+            self.current_bytes -= self.entries.pop(key).nbytes
+
+        self.entries[key] = packed
+        self.current_bytes += packed.nbytes
+
+        # Evict the least recently used masks until we are back within budget
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def unpack(self, key, packed):
+        height, width = key[2][:2]
+        mask = np.unpackbits(packed, count=height * width).reshape(height, width).view(bool)
+
+        self.last_key = key
+        self.last_mask = mask
+        return mask
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
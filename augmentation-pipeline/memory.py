@@ -0,0 +1,140 @@
+import os
+import sys
+import resource
+import tracemalloc
+import cv2
+import numpy as np
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, since the last `reset_peak_rss()` on Linux.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is the lifetime peak, in KB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 1024
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size reported by `peak_rss_mb()`.
+
+    Returns:
+        bool: False if the peak cannot be reset on this platform, in which case
+              `peak_rss_mb()` keeps reporting the lifetime peak.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class MemoryTracker:
+    """
+    Measures the peak RSS of the process while a block runs, e.g. while a clip is processed.
+
+    With `trace_allocations` (and `tracemalloc` started), the tracemalloc peak and
+    the source lines that retained the most memory during the block are recorded too.
+    """
+
+    def __init__(self, trace_allocations=False, top=3):
+        self.trace_allocations = trace_allocations and tracemalloc.is_tracing()
+        self.top = top
+        self.record = {}
+
+    def __enter__(self):
+        reset_peak_rss()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            self.snapshot = tracemalloc.take_snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record = {'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+        if self.trace_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            growth = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')[:self.top]
+            self.record['tracemalloc_peak_mb'] = round(peak / 2**20, 1)
+            self.record['tracemalloc_top'] = '; '.join(
+                f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno} {stat.size_diff / 2**20:+.1f}MB"
+                for stat in growth
+            )
+            self.snapshot = None
+
+def probe_frame_size(path):
+    """
+    Returns the (width, height) of a video from its header, or None if it cannot be read.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        return int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        capture.release()
+
+class MemoryModel:
+    """
+    Predicts the peak RSS of a worker processing one source clip.
+
+    Frames are decoded and augmented a window at a time, so memory grows with the
+    frame size times the number of frames buffered (at most a window) and the
+    number of segments rendered from the clip, not with the clip length:
+
+        peak_mb = base_mb + mb_per_unit * width * height * (min(frames, window_size) + segments)
+
+    The coefficients start from a conservative prior and are refitted with least
+    squares from the peaks recorded in the progress of completed segments.
+    """
+
+    def __init__(self, window_size=64, base_mb=400.0, mb_per_unit=12 / 2**20, min_samples=5, margin=1.2):
+        self.window_size = window_size
+        self.base_mb = base_mb
+        self.mb_per_unit = mb_per_unit
+        self.min_samples = min_samples
+        self.margin = margin
+        self.samples = []
+        self.fitted_samples = 0
+
+    def units(self, width, height, frames, segments):
+        return width * height * (min(frames, self.window_size) + segments)
+
+    def observe(self, units, peak_mb):
+        self.samples.append((units, peak_mb))
+
+    def observe_progress(self, progress_data):
+        """
+        Adds the peaks recorded in progress records, one sample per source clip.
+        """
+        columns = ['peak_rss_mb', 'frame_width', 'frame_height', 'frames', 'group_segments']
+        if progress_data.empty or not set(columns) <= set(progress_data.columns):
+            return
+
+        clips = progress_data.dropna(subset=columns).drop_duplicates(subset='narration_id')
+        for record in clips[columns].itertuples(index=False):
+            self.observe(self.units(record.frame_width, record.frame_height, record.frames, record.group_segments), record.peak_rss_mb)
+
+    def fit(self):
+        if len(self.samples) < self.min_samples or len(self.samples) == self.fitted_samples:
+            return
+
+        units, peaks = np.array(self.samples, dtype=float).T
+        self.fitted_samples = len(self.samples)
+        if np.ptp(units) == 0:
+            return
+
+        slope, intercept = np.polyfit(units, peaks, 1)
+        if slope > 0 and intercept > 0:
+            self.mb_per_unit, self.base_mb = slope, intercept
+
+    def predict(self, width, height, frames, segments):
+        self.fit()
+        return (self.base_mb + self.mb_per_unit * self.units(width, height, frames, segments)) * self.margin
@@ -0,0 +1,285 @@
+from collections import namedtuple
+import numpy as np
+from augment import find_nearest_annotation_positions, rasterize_occlusion_mask, apply_occlusion_mask_stack
+from photometric import photometric_lut, apply_lut, DEFAULT_DARKEN_GAMMA
+from degradations import (
+    motion_blur_stack, shake_trajectory, shake_stack, NoiseBank,
+    DEFAULT_BLUR_LENGTH, DEFAULT_BLUR_ANGLE, DEFAULT_SHAKE_AMPLITUDE, DEFAULT_SHAKE_ROTATION, DEFAULT_SHAKE_SMOOTHNESS, DEFAULT_NOISE_SIGMA,
+)
+
+# Worker resources an operator may need while preparing a segment: `annotations(video_id)`
+# returns the video's AnnotationIndex and `masks` is the worker's OcclusionMaskCache
+OperatorContext = namedtuple('OperatorContext', ['annotations', 'masks'])
+
+class FrameStackOperator:
+    """
+    An augmentation applied to a window of frames at a time.
+
+    `prepare` is called once per segment with the source frame ids of the clip.
+    `frames_needed` then declares which frames of the clip the operator reads, so
+    only those are decoded, and `apply` is called once per decoded window with a
+    (T, H, W, C) stack of `dtype` frames and their indices in the clip. `apply`
+    returns the frames to write, which may be fewer than it was given (e.g. to
+    truncate the segment) or none at all.
+
+    `out`, when given, is a writable stack of the same shape and dtype that the
+    operator may write its result to instead of allocating a new one. Operators
+    with `in_place = True` also accept `out=frames` and then transform the window
+    itself; the pipeline only does so when no other segment still needs the window.
+    """
+
+    dtype = np.uint8
+    in_place = False
+
+    def prepare(self, row, params, frame_ids, context):
+        """
+        Returns the per-segment state passed to every `apply` call.
+        """
+        return params
+
+    def frames_needed(self, state, frame_count):
+        """
+        Returns the sorted indices of the clip frames the operator reads, by default all of them.
+        """
+        return np.arange(frame_count)
+
+    def apply(self, frames, indices, state, out=None):
+        """
+        Augments the frames at `indices` of the clip, a window of the frames declared by `frames_needed`.
+        """
+        raise NotImplementedError
+
+def union_frame_indices(needs, frame_count):
+    """
+    Returns the sorted clip frame indices needed by any of the operators of a clip.
+    """
+    if any(len(needed) == frame_count for needed in needs):
+        return np.arange(frame_count)
+    return np.unique(np.concatenate(needs)) if needs else np.arange(0)
+
+def select_needed_frames(frames, indices, needed):
+    """
+    Selects the frames of a decoded window that an operator declared in `needed`.
+
+    Frames are only copied when the selection is not contiguous; otherwise a view
+    of the window is returned.
+
+    Returns:
+        tuple: `(frames, indices)` of the selected frames.
+    """
+    positions = np.minimum(np.searchsorted(needed, indices), len(needed) - 1)
+    selected = np.flatnonzero(needed[positions] == indices) if len(needed) else np.arange(0)
+
+    if len(selected) == len(indices):
+        return frames, indices
+    if len(selected) == 0 or selected[-1] - selected[0] + 1 == len(selected):
+        window = slice(selected[0], selected[-1] + 1) if len(selected) else slice(0, 0)
+        return frames[window], indices[window]
+    return frames[selected], indices[selected]
+
+# Operators by augment_type, see `register_operator`
+OPERATORS = {}
+
+def register_operator(*augment_types):
+    """
+    Class decorator registering an operator instance for the given augment types.
+    """
+    def register(operator_class):
+        for augment_type in augment_types:
+            OPERATORS[augment_type] = operator_class()
+        return operator_class
+    return register
+
+# Separates the operators of a composite augment_type, e.g. 'darken+occlusion'
+COMPOSITE_SEPARATOR = '+'
+
+def composite_types(augment_type):
+    """
+    Returns the augment types applied by `augment_type`, in order: itself, or the parts of a composite.
+    """
+    return str(augment_type).split(COMPOSITE_SEPARATOR)
+
+def get_operator(augment_type):
+    if COMPOSITE_SEPARATOR in str(augment_type):
+        return OPERATORS['composite']
+    # Augment types without an operator are written unchanged, as before the registry
+    return OPERATORS.get(augment_type, OPERATORS['identity'])
+
+@register_operator('identity', 'object_presence')
+class IdentityOperator(FrameStackOperator):
+    in_place = True
+
+    def apply(self, frames, indices, state, out=None):
+        # Frames are only read by the encoder, so there is nothing to copy
+        return frames
+
+@register_operator('darken')
+class DarkenOperator(FrameStackOperator):
+    """
+    Gamma correction and other photometric transforms through a lookup table, see `photometric_lut`.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        return photometric_lut(params, default_gamma=DEFAULT_DARKEN_GAMMA)
+
+    def apply(self, frames, indices, lut, out=None):
+        return apply_lut(frames, lut, out=out)
+
+@register_operator('completeness')
+class CompletenessOperator(FrameStackOperator):
+    """
+    Truncates the segment after frame `params['frame_count']`, so the action is not completed.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        # Frames 0 to frame_count are kept
+        return params['frame_count'] + 1
+
+    def frames_needed(self, state, frame_count):
+        # Only the kept prefix is decoded
+        return np.arange(min(state, frame_count))
+
+    def apply(self, frames, indices, keep, out=None):
+        # A view of the kept frames, nothing is copied
+        return frames[:np.searchsorted(indices, keep)]
+
+@register_operator('occlusion')
+class OcclusionOperator(FrameStackOperator):
+    """
+    Blacks out the bounding rectangles of the objects annotated on the nearest VISOR frame.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        annotations = context.annotations(row['video_id'])
+        positions = find_nearest_annotation_positions(frame_ids, annotations)
+        return {'video_id': row['video_id'], 'annotations': annotations, 'positions': positions, 'masks': context.masks}
+
+    def apply(self, frames, indices, state, out=None):
+        positions = state['positions'][indices]
+        if out is None:
+            out = np.empty_like(frames)
+
+        # Consecutive frames usually map to the same annotated frame, so the stack
+        # is split into runs that share one mask
+        run_starts = np.concatenate([[0], np.flatnonzero(np.diff(positions)) + 1, [len(positions)]])
+        for run_start, run_stop in zip(run_starts[:-1], run_starts[1:]):
+            position = int(positions[run_start])
+            # The annotations of the frame are only built when its mask is not cached
+            mask_key = (state['video_id'], int(state['annotations'].frame_ids[position]), frames.shape[1:])
+            mask = state['masks'].get_or_build(mask_key, lambda: rasterize_occlusion_mask(state['annotations'].frame(position), frames.shape[1:]))
+            run_frames = frames[run_start:run_stop]
+            apply_occlusion_mask_stack(run_frames, mask, out=run_frames if out is frames else out[run_start:run_stop])
+        return out
+
+@register_operator('motion_blur')
+class MotionBlurOperator(FrameStackOperator):
+    """
+    Blurs the frames along the direction of a camera motion, see `motion_blur_stack`.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        return {
+            'length': int(params.get('length', DEFAULT_BLUR_LENGTH)),
+            'angle': float(params.get('angle', DEFAULT_BLUR_ANGLE)),
+        }
+
+    def apply(self, frames, indices, state, out=None):
+        return motion_blur_stack(frames, state['length'], state['angle'], out=out)
+
+@register_operator('camera_shake')
+class CameraShakeOperator(FrameStackOperator):
+    """
+    Shakes the camera along a seeded random walk, computed once for the whole segment.
+    """
+
+    # Warps read pixels from all over the frame, so they cannot write to it
+    in_place = False
+
+    def prepare(self, row, params, frame_ids, context):
+        trajectory = shake_trajectory(
+            len(frame_ids),
+            amplitude=float(params.get('amplitude', DEFAULT_SHAKE_AMPLITUDE)),
+            rotation=float(params.get('rotation', DEFAULT_SHAKE_ROTATION)),
+            smoothness=float(params.get('smoothness', DEFAULT_SHAKE_SMOOTHNESS)),
+            seed=params.get('seed'),
+        )
+        bounds = np.abs(trajectory[:, :2]).max(axis=0) if len(trajectory) else np.zeros(2)
+        return {'trajectory': trajectory, 'bounds': bounds}
+
+    def apply(self, frames, indices, state, out=None):
+        return shake_stack(frames, state['trajectory'][indices], state['bounds'], out=out)
+
+@register_operator('sensor_noise')
+class SensorNoiseOperator(FrameStackOperator):
+    """
+    Adds Gaussian sensor noise of standard deviation `params['sigma']` from a seeded `NoiseBank`.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        bank = NoiseBank(sigma=float(params.get('sigma', DEFAULT_NOISE_SIGMA)), seed=params.get('seed'))
+        return {'bank': bank, 'choices': bank.choices(len(frame_ids))}
+
+    def apply(self, frames, indices, state, out=None):
+        return state['bank'].apply(frames, state['choices'][indices], out=out)
+
+@register_operator('composite')
+class CompositeOperator(FrameStackOperator):
+    """
+    Applies several operators in order in a single pass, e.g. darken then occlusion then completeness.
+
+    The operators are listed in `params['operators']` as `{'type': ..., 'params': ...}`
+    dicts, or derived from a composite augment_type like 'darken+occlusion' with
+    default params. Operators must return the frames they are given or a prefix of
+    them, like completeness, so the composite only needs the frames every operator needs.
+
+    Each operator after the first transforms the previous result in place when it
+    can, so the frames are neither decoded nor encoded more than once.
+    """
+
+    in_place = True
+
+    def prepare(self, row, params, frame_ids, context):
+        operators = params.get('operators') or [{'type': augment_type} for augment_type in composite_types(row['augment_type'])]
+        stages = []
+        for spec in operators:
+            operator = get_operator(spec['type'])
+            stages.append((operator, operator.prepare(row, spec.get('params') or {}, frame_ids, context)))
+        return stages
+
+    def frames_needed(self, stages, frame_count):
+        needed = np.arange(frame_count)
+        for operator, state in stages:
+            stage_needed = operator.frames_needed(state, frame_count)
+            if len(stage_needed) < len(needed):
+                needed = np.intersect1d(needed, stage_needed, assume_unique=True)
+        return needed
+
+    def apply(self, frames, indices, stages, out=None):
+        window = frames
+        # The window itself may only be modified when the pipeline allows it
+        owns_window = out is frames
+
+        for operator, state in stages:
+            owned = owns_window or not np.may_share_memory(frames, window)
+            if owned and operator.in_place:
+                stage_out = frames
+            elif out is not None and not np.may_share_memory(out, frames):
+                stage_out = out[:len(frames)]
+            else:
+                stage_out = None
+
+            frames = operator.apply(frames, indices, state, out=stage_out)
+            indices = indices[:len(frames)]
+            if len(frames) == 0:
+                break
+        return frames
@@ -0,0 +1,85 @@
+import functools
+import cv2
+import numpy as np
+
+# Gamma of the darken augmentation in plans that do not set one
+DEFAULT_DARKEN_GAMMA = 4.0
+
+# Every value a uint8 channel can take, normalized to [0, 1]
+INTENSITIES = np.arange(256) / 255.0
+
+@functools.lru_cache(maxsize=64)
+def compile_lut(gamma=1.0, brightness=0.0, contrast=1.0, tone_curve=None):
+    """
+    Compiles a per-intensity transform into a uint8 lookup table.
+
+    The steps are applied in order, on intensities normalized to [0, 1]; steps
+    left at their default are skipped:
+
+    1. gamma: `x ** gamma`, darker for gamma > 1.
+    2. contrast: scales the distance from mid-grey, `(x - 0.5) * contrast + 0.5`.
+    3. brightness: adds `brightness`, e.g. -0.2 for 20% darker.
+    4. tone_curve: piecewise linear curve through `(input, output)` points in [0, 1].
+
+    The result is clipped to [0, 1] and truncated to uint8, as the darken augmentation always did.
+
+    Args:
+        gamma (float): Gamma exponent.
+        brightness (float): Offset added to every intensity.
+        contrast (float): Contrast factor.
+        tone_curve (tuple): Optional `((input, output), ...)` control points, sorted by input.
+
+    Returns:
+        np.ndarray: A (256,) uint8 table, shared between calls with the same arguments.
+    """
+    values = INTENSITIES
+    if gamma != 1.0:
+        values = np.power(values, gamma)
+    if contrast != 1.0:
+        values = (values - 0.5) * contrast + 0.5
+    if brightness != 0.0:
+        values = values + brightness
+    if tone_curve is not None:
+        inputs, outputs = zip(*tone_curve)
+        values = np.interp(values, inputs, outputs)
+
+    lut = (np.clip(values, 0.0, 1.0) * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+def photometric_lut(params, default_gamma=1.0):
+    """
+    Returns the lookup table described by the `gamma`, `brightness`, `contrast`
+    and `tone_curve` entries of an augmentation's params, see `compile_lut`.
+    """
+    tone_curve = params.get('tone_curve')
+    return compile_lut(
+        gamma=float(params.get('gamma', default_gamma)),
+        brightness=float(params.get('brightness', 0.0)),
+        contrast=float(params.get('contrast', 1.0)),
+        tone_curve=tuple(map(tuple, tone_curve)) if tone_curve is not None else None,
+    )
+
+def apply_lut(frames, lut, out=None):
+    """
+    Maps every channel value of a frame or a (T, H, W, C) frame stack through `lut`.
+
+    Args:
+        frames (np.ndarray): uint8 frame(s).
+        lut (np.ndarray): (256,) uint8 table.
+        out (np.ndarray): Optional array of the same shape to write to, which may be
+                          `frames` itself to transform the frames in place.
+
+    Returns:
+        np.ndarray: The mapped frame(s).
+    """
+    if out is None:
+        out = np.empty_like(frames)
+
+    if frames.flags.c_contiguous and out.flags.c_contiguous:
+        # cv2.LUT works on 2D images, so view the whole stack as rows of the last two axes
+        rows = frames.shape[-2] * frames.shape[-1] if frames.ndim > 2 else frames.shape[-1]
+        cv2.LUT(frames.reshape(-1, rows), lut, dst=out.reshape(-1, rows))
+    else:
+        np.take(lut, frames, out=out)
+    return out
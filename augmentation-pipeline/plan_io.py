@@ -0,0 +1,125 @@
+import ast
+import json
+import zlib
+from collections import namedtuple
+import pandas as pd
+
+# Columns of the augmentation plan, in file order
+PLAN_COLUMNS = ['segment_id', 'narration_id', 'participant_id', 'video_id', 'start_frame', 'stop_frame', 'narration', 'augment_type', 'augment_params']
+
+# A plan row as sent to pool workers: a plain tuple that still allows `row.video_id` access
+PlanRow = namedtuple('PlanRow', PLAN_COLUMNS)
+
+# Low-cardinality columns stored as dictionary-encoded categoricals
+CATEGORICAL_COLUMNS = ['participant_id', 'video_id', 'augment_type']
+
+def is_parquet_path(path):
+    return str(path).endswith(('.parquet', '.pq'))
+
+def plan_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('segment_id', pa.string()),
+        ('narration_id', pa.string()),
+        ('participant_id', category),
+        ('video_id', category),
+        ('start_frame', pa.int64()),
+        ('stop_frame', pa.int64()),
+        ('narration', pa.string()),
+        ('augment_type', category),
+        # Each augmentation has its own parameters, so they are stored as a JSON object
+        ('augment_params', pa.string()),
+    ])
+
+def parse_augment_params(value):
+    """
+    Converts a stored `augment_params` value back into a dict.
+
+    Plans are written with JSON parameters. Plans written by earlier versions
+    hold the Python repr of the dict instead, which is parsed as a literal
+    rather than evaluated.
+    """
+    if isinstance(value, dict):
+        return value
+    if not isinstance(value, str) or not value:
+        return {}
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return ast.literal_eval(value)
+
+def write_plan(plan_data, path):
+    """
+    Saves the augmentation plan, as Parquet if `path` ends in `.parquet` and as CSV otherwise.
+
+    Args:
+        plan_data (pd.DataFrame): Plan rows with `augment_params` dicts.
+        path (str): Output path.
+    """
+    plan_data = plan_data[PLAN_COLUMNS].assign(
+        augment_params=[json.dumps(params) for params in plan_data['augment_params']]
+    )
+
+    if not is_parquet_path(path):
+        plan_data.to_csv(path, index=False)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for column in CATEGORICAL_COLUMNS:
+        plan_data[column] = plan_data[column].astype('category')
+
+    table = pa.Table.from_pandas(plan_data, schema=plan_schema(), preserve_index=False)
+    pq.write_table(table, path)
+
+def read_plan(path):
+    """
+    Loads an augmentation plan written by `write_plan`, or a CSV plan from an earlier version.
+
+    Returns:
+        pd.DataFrame: The plan with categorical `participant_id`, `video_id` and
+                      `augment_type` columns and `augment_params` parsed into dicts.
+    """
+    if is_parquet_path(path):
+        plan_data = pd.read_parquet(path)
+    else:
+        plan_data = pd.read_csv(path, dtype={column: 'category' for column in CATEGORICAL_COLUMNS})
+
+    plan_data['augment_params'] = [parse_augment_params(value) for value in plan_data['augment_params']]
+    return plan_data
+
+def plan_rows(plan_data):
+    """
+    Converts plan rows into `PlanRow` tuples of Python values.
+
+    Tuples are much cheaper to keep in memory and to pickle into pool workers
+    than pandas Series or dicts. Use `row._asdict()` for a mutable record.
+    """
+    plan_data = plan_data[PLAN_COLUMNS].astype({column: object for column in CATEGORICAL_COLUMNS})
+    return [PlanRow._make(values) for values in plan_data.itertuples(index=False, name=None)]
+
+def shard_plan(plan_data, num_shards, shard_index):
+    """
+    Selects the plan rows of one shard.
+
+    Rows are assigned by a CRC32 of their `narration_id`, which is stable across
+    hosts and Python processes, so every host derives the same partition from the
+    same plan without any coordination, and all augmentations of a narration land
+    on the same shard.
+
+    Args:
+        plan_data (pd.DataFrame): The augmentation plan.
+        num_shards (int): Total number of shards.
+        shard_index (int): Shard to select, in `[0, num_shards)`.
+
+    Returns:
+        pd.DataFrame: The rows of the shard.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard index {shard_index} is out of range for {num_shards} shards")
+
+    shards = [zlib.crc32(str(narration_id).encode()) % num_shards for narration_id in plan_data['narration_id']]
+    return plan_data[[shard == shard_index for shard in shards]]
@@ -0,0 +1,153 @@
+import os
+import glob
+import json
+import pandas as pd
+
+class ProgressJournal:
+    """
+    Append-only record of processed plan rows, backing the progress CSV.
+
+    Every completed task appends one JSON line per row and fsyncs the journal,
+    so recording progress costs O(rows in the task) instead of rewriting the
+    whole progress CSV. On exit the journal is compacted into the progress CSV,
+    which stays the exported format. Resuming reads the CSV and the journal once,
+    in O(completed) time.
+    """
+
+    def __init__(self, progress_csv_path, journal_path=None):
+        self.progress_csv_path = progress_csv_path
+        self.journal_path = journal_path or f"{progress_csv_path}.journal"
+
+    def read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return []
+
+        records = []
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                # A crash mid-write can leave a truncated last line, it was never fsync'd
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def read_progress(self):
+        """
+        Returns every recorded row, from the progress CSV and the journal, as a DataFrame.
+        """
+        frames = []
+        if os.path.exists(self.progress_csv_path):
+            frames.append(pd.read_csv(self.progress_csv_path))
+
+        records = self.read_journal()
+        if records:
+            frames.append(pd.DataFrame(records))
+
+        if not frames:
+            return pd.DataFrame()
+
+        progress_data = pd.concat(frames, ignore_index=True)
+        # The latest record of a segment wins, e.g. after a crash during compaction
+        return progress_data.drop_duplicates(subset='segment_id', keep='last')
+
+    def completed_segments(self):
+        progress_data = self.read_progress()
+        if progress_data.empty:
+            return set()
+        return set(progress_data[progress_data['status'] == 'completed']['segment_id'])
+
+    def append(self, rows):
+        """
+        Appends one line per row (dicts or pandas Series) and fsyncs the journal.
+        """
+        with open(self.journal_path, 'a+b') as f:
+            # Terminate a line truncated by a crash, so it does not swallow the next record
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+            for row in rows:
+                f.write(((row.to_json() if isinstance(row, pd.Series) else json.dumps(row)) + '\n').encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, columns=None):
+        """
+        Folds the journal into the progress CSV and removes it.
+
+        Args:
+            columns (list): Optional leading column order for the progress CSV.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+
+        # Replace the CSV atomically so an interrupted compaction keeps the journal usable
+        write_progress_csv(self.read_progress(), self.progress_csv_path, columns)
+        os.remove(self.journal_path)
+
+def write_progress_csv(progress_data, progress_csv_path, columns=None):
+    """
+    Atomically replaces the progress CSV with `progress_data`.
+
+    Args:
+        progress_data (pd.DataFrame): Progress records.
+        progress_csv_path (str): Path to the progress CSV.
+        columns (list): Optional leading column order.
+    """
+    if columns is not None:
+        extra_columns = [column for column in progress_data.columns if column not in columns]
+        progress_data = progress_data.reindex(columns=list(columns) + extra_columns)
+
+    # Nested values such as augment_params are written as JSON, like in the plan
+    for column in progress_data.columns[progress_data.dtypes == object]:
+        progress_data[column] = [json.dumps(value) if isinstance(value, (dict, list)) else value for value in progress_data[column]]
+
+    tmp_path = f"{progress_csv_path}.tmp"
+    progress_data.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, progress_csv_path)
+
+def shard_progress_path(progress_csv_path, shard_index, num_shards):
+    """
+    Returns the progress CSV of one shard, e.g. `progress.shard-0-of-4.csv` for `progress.csv`.
+    """
+    root, ext = os.path.splitext(progress_csv_path)
+    return f"{root}.shard-{shard_index}-of-{num_shards}{ext}"
+
+def find_shard_progress_paths(progress_csv_path):
+    """
+    Returns the progress paths of every shard that left a progress CSV or journal next to `progress_csv_path`.
+    """
+    root, ext = os.path.splitext(progress_csv_path)
+    pattern = f"{glob.escape(root)}.shard-*-of-*{ext}"
+    paths = set(glob.glob(pattern))
+    paths.update(path[:-len('.journal')] for path in glob.glob(f"{pattern}.journal"))
+    return sorted(paths)
+
+def merge_progress(progress_csv_path, shard_paths):
+    """
+    Combines the progress of every shard into the progress CSV.
+
+    Records already in the progress CSV are kept, and the latest record of a
+    segment wins. The shard files are left in place, so merging again after a
+    shard resumes is safe.
+
+    Args:
+        progress_csv_path (str): Path to the combined progress CSV.
+        shard_paths (list): Progress CSV paths of the shards, see `shard_progress_path`.
+
+    Returns:
+        pd.DataFrame: The combined progress.
+    """
+    frames = [ProgressJournal(progress_csv_path).read_progress()]
+    frames.extend(ProgressJournal(path).read_progress() for path in shard_paths)
+    frames = [frame for frame in frames if not frame.empty]
+
+    if not frames:
+        return pd.DataFrame()
+
+    progress_data = pd.concat(frames, ignore_index=True).drop_duplicates(subset='segment_id', keep='last')
+    write_progress_csv(progress_data, progress_csv_path)
+    return progress_data
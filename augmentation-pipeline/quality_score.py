@@ -0,0 +1,63 @@
+import numpy as np
+
+# Quality dimensions annotated for every segment, each on a 1-5 scale
+QUALITY_DIMENSIONS = ['camera_motion', 'lighting', 'focus', 'action_completeness', 'object_presence']
+
+def dimension_values(data, dimensions):
+    return [data[dim].to_numpy(dtype=float) for dim in dimensions]
+
+def harmonic_mean_score(data, dimensions=QUALITY_DIMENSIONS):
+    """
+    Calculates the quality score of every row as the normalized harmonic mean of its quality dimensions.
+
+    Dimensions equal to zero are left out of the harmonic mean. Rows with an
+    `action_presence` of 0, or with every dimension equal to zero, score 0.
+
+    Args:
+        data (pd.DataFrame): Rows with an `action_presence` column and the quality dimension columns.
+        dimensions (list): The quality dimension columns to use.
+
+    Returns:
+        np.ndarray: The quality scores, between 0 and 1.
+    """
+    # Sum the inverses column by column, in the same order as the per-row formula
+    sum_of_inverses = np.zeros(len(data))
+    for values in dimension_values(data, dimensions):
+        with np.errstate(divide='ignore'):
+            sum_of_inverses = sum_of_inverses + np.where(values != 0, 1.0 / values, 0.0)
+
+    # Define the min and max values for the harmonic mean
+    HM_min = 1  # The harmonic mean is at least 1 when all dimensions are equal to 1
+    HM_max = 5  # The harmonic mean is at most 5 when all dimensions are equal to 5
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic_mean = len(dimensions) / sum_of_inverses
+        normalized_score = (harmonic_mean - HM_min) / (HM_max - HM_min)
+
+    action_presence = data['action_presence'].to_numpy(dtype=float)
+    return np.where((action_presence == 0) | (sum_of_inverses == 0), 0.0, normalized_score)
+
+def power_mean_score(data, power=1, dimensions=QUALITY_DIMENSIONS):
+    """
+    Calculates the quality score of every row as the normalized sum of its quality dimensions raised to `power`.
+
+    With `power=1` this is the plain mean of the dimensions divided by 5. Rows with
+    an `action_presence` of 0 score 0.
+
+    Args:
+        data (pd.DataFrame): Rows with an `action_presence` column and the quality dimension columns.
+        power (int): Exponent applied to every dimension.
+        dimensions (list): The quality dimension columns to use.
+
+    Returns:
+        np.ndarray: The quality scores.
+    """
+    # Sum the weighted quality dimensions, assume equal weights for simplicity
+    total = np.zeros(len(data))
+    for values in dimension_values(data, dimensions):
+        total = total + values ** power
+
+    score = total / (len(dimensions) ** (power + 1))
+
+    action_presence = data['action_presence'].to_numpy(dtype=float)
+    return np.where(action_presence == 0, 0.0, score)
@@ -0,0 +1,178 @@
+import os
+import queue
+import threading
+import subprocess as sp
+import numpy as np
+from moviepy.config import get_setting
+
+class StreamingVideoWriter:
+    """
+    Encodes frames with an ffmpeg subprocess as soon as they are produced.
+
+    Unlike building an `ImageSequenceClip` from a list of frames, only the frame
+    being written is held in memory, so peak memory does not grow with clip length.
+    The ffmpeg command mirrors what moviepy's `write_videofile` runs, so the output
+    matches the previous pipeline for the same codec settings.
+
+    The video is written to a temporary file and renamed into place on `close()`,
+    so an interrupted run never leaves a truncated video at `path`.
+    """
+
+    def __init__(self, path, fps, codec='libx264', preset='medium', crf=None, bitrate=None, ffmpeg_params=None):
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.bitrate = bitrate
+        self.ffmpeg_params = ffmpeg_params
+        self.proc = None
+        self.frames_written = 0
+
+        root, ext = os.path.splitext(path)
+        self.tmp_path = f"{root}.partial{ext}"
+
+    def build_command(self, width, height):
+        # Order is important, see moviepy.video.io.ffmpeg_writer.FFMPEG_VideoWriter
+        cmd = [
+            get_setting("FFMPEG_BINARY"),
+            '-y',
+            '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-s', '%dx%d' % (width, height),
+            '-pix_fmt', 'rgb24',
+            '-r', '%.02f' % self.fps,
+            '-an', '-i', '-',
+            '-vcodec', self.codec,
+            '-preset', self.preset,
+        ]
+        if self.ffmpeg_params is not None:
+            cmd.extend(self.ffmpeg_params)
+        if self.crf is not None:
+            cmd.extend(['-crf', str(self.crf)])
+        if self.bitrate is not None:
+            cmd.extend(['-b', self.bitrate])
+        if self.codec == 'libx264' and width % 2 == 0 and height % 2 == 0:
+            cmd.extend(['-pix_fmt', 'yuv420p'])
+        cmd.append(self.tmp_path)
+        return cmd
+
+    def write(self, frame):
+        """
+        Writes a single (height, width, 3) uint8 RGB frame.
+        """
+        if self.proc is None:
+            # The frame size is only known once the first frame arrives
+            height, width = frame.shape[:2]
+            self.proc = sp.Popen(self.build_command(width, height), stdin=sp.PIPE, stdout=sp.DEVNULL, stderr=sp.PIPE)
+
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except (BrokenPipeError, OSError) as e:
+            raise IOError(f"ffmpeg failed while writing {self.path}: {self.proc.stderr.read().decode()}") from e
+
+        self.frames_written += 1
+
+    def write_frames(self, frames):
+        for frame in frames:
+            self.write(frame)
+
+    def close(self):
+        """
+        Flushes the encoder and moves the finished video into place.
+        """
+        if self.proc is None:
+            raise ValueError(f"No frames were written to {self.path}")
+
+        self.proc.stdin.close()
+        stderr = self.proc.stderr.read().decode()
+        if self.proc.wait() != 0:
+            raise IOError(f"ffmpeg failed while writing {self.path}: {stderr}")
+        self.proc = None
+
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """
+        Stops the encoder and removes the partially written video.
+        """
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def iter_frame_windows(vr, frame_indices, window_size=64):
+    """
+    Decodes frames of a decord `VideoReader` in windows.
+
+    Args:
+        vr: decord VideoReader.
+        frame_indices: Sorted indices of the frames to decode, or a frame count to
+                       decode the first `frame_indices` frames.
+        window_size (int): Maximum number of frames decoded at once.
+
+    Yields:
+        tuple: `(indices, frames)` where `frames` is a (T, H, W, C) uint8 array holding
+               the frames at the T `indices`.
+    """
+    if np.isscalar(frame_indices):
+        frame_indices = np.arange(frame_indices)
+
+    for start in range(0, len(frame_indices), window_size):
+        indices = frame_indices[start:start + window_size]
+        # `get_batch` returns a decord NDArray, which can be converted to a numpy array
+        yield indices, vr.get_batch(indices.tolist()).asnumpy()
+
+def prefetch(iterator, depth=1):
+    """
+    Runs `iterator` in a background thread, keeping up to `depth` items ready.
+
+    Decoding the next window then overlaps with augmenting and encoding the
+    current one, while memory stays bounded to `depth + 1` windows.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    return
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+        items.put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Unblock the producer if the consumer stopped early
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.1)
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class LeaseQueue:
+    """
+    Work queue of plan tasks in a SQLite file, shared by workers on any number of processes or hosts.
+
+    A worker claims a task with a time-limited lease and renews it while the task
+    runs. If the worker dies, its lease expires and the task is handed to the next
+    worker that asks for one. Workers can therefore join or leave mid-run, and the
+    last tasks are spread over every worker still running instead of a fixed shard.
+
+    Tasks are claimed largest first, so long tasks do not start at the tail of the run.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        with self.transaction() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    rows TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, size)")
+            db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @contextmanager
+    def transaction(self):
+        # Autocommit mode with explicit transactions; IMMEDIATE takes the write lock up front,
+        # so two workers can never claim the same task
+        db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    @staticmethod
+    def default_owner():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def bind_schedule(self, schedule):
+        """
+        Records how the plan is split into tasks, the first time any run uses the queue.
+
+        Task ids are derived from the rows of a task, so a run splitting the plan
+        differently would queue the same rows again under other ids.
+
+        Raises:
+            ValueError: If the queue was filled with another schedule.
+        """
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('schedule', ?)", (schedule,))
+            queued = db.execute("SELECT value FROM settings WHERE key = 'schedule'").fetchone()[0]
+        if queued != schedule:
+            raise ValueError(f"The work queue {self.db_path} holds {queued} tasks, run with --schedule {queued}")
+
+    def populate(self, tasks):
+        """
+        Adds tasks to the queue, ignoring tasks that were already added by another worker.
+
+        Args:
+            tasks (list): `(task_id, rows)` pairs, where `rows` is a JSON-serializable list.
+                          Every worker must derive the same ids for the same tasks.
+
+        Returns:
+            int: Number of tasks added.
+        """
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (task_id, rows, size) VALUES (?, ?, ?)",
+                [(task_id, json.dumps(rows), len(rows)) for task_id, rows in tasks],
+            )
+            return db.total_changes - before
+
+    def claim(self, owner):
+        """
+        Leases the largest pending task, or a task whose lease expired.
+
+        A worker that crashes never calls `fail`, so expired leases of tasks that
+        were already attempted `max_attempts` times are marked as failed instead.
+
+        Returns:
+            tuple: `(task_id, rows)`, or None if no task can be claimed right now.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = 'failed', owner = NULL, lease_expires = NULL, "
+                "error = COALESCE(error, 'lease expired after ' || attempts || ' attempts') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            task = db.execute(
+                "SELECT task_id, rows FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                "AND attempts < ? ORDER BY size DESC LIMIT 1",
+                (now, self.max_attempts),
+            ).fetchone()
+            if task is None:
+                return None
+
+            db.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE task_id = ?",
+                (owner, now + self.lease_seconds, task[0]),
+            )
+        return task[0], json.loads(task[1])
+
+    def renew(self, task_id, owner):
+        """
+        Extends the lease of a task. Returns False if the lease was lost to another worker.
+        """
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, owner),
+            )
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def hold(self, task_id, owner):
+        """
+        Renews the lease of a task in a background thread while the block runs.
+        """
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(task_id, owner):
+                    print(f"Lost the lease of task {task_id}, another worker may process it again")
+                    return
+
+        thread = threading.Thread(target=keep_alive, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, task_id, rows):
+        """
+        Marks a task as completed and stores its processed rows.
+
+        Outputs are renamed into place when finished, so a task that was processed
+        twice after a lost lease is still recorded once.
+        """
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = 'completed', rows = ?, lease_expires = NULL, error = NULL WHERE task_id = ?",
+                (json.dumps(rows), task_id),
+            )
+
+    def fail(self, task_id, owner, error):
+        """
+        Releases a task after an error. It is retried until it failed `max_attempts` times.
+        """
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, error = ? WHERE task_id = ? AND owner = ?",
+                (self.max_attempts, error, task_id, owner),
+            )
+
+    def has_unfinished(self):
+        """
+        Returns True while any task is pending or leased, including leases that will expire.
+        """
+        with self.transaction() as db:
+            return db.execute("SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1").fetchone() is not None
+
+    def counts(self):
+        """
+        Returns the number of plan rows per task status.
+        """
+        with self.transaction() as db:
+            return dict(db.execute("SELECT status, SUM(size) FROM tasks GROUP BY status").fetchall())
+
+    def finished_rows(self):
+        """
+        Returns the processed rows of every completed task, and the rows of failed tasks with their error.
+        """
+        with self.transaction() as db:
+            tasks = db.execute("SELECT status, rows, error FROM tasks WHERE status IN ('completed', 'failed')").fetchall()
+
+        rows = []
+        for status, task_rows, error in tasks:
+            for row in json.loads(task_rows):
+                if status == 'failed':
+                    row['status'] = f'error: {error}'
+                rows.append(row)
+        return rows
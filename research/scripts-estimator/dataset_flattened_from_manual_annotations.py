@@ -1,44 +1,18 @@
+import os
+import sys
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'augmentation-pipeline'))
+from quality_score import harmonic_mean_score
+
 # Load the CSV files
 ground_truth_data = pd.read_csv('/home/ec2-user/environment/data-estimator/manual_annotations_raw_dataset.csv')
 quality_data = pd.read_csv('/home/ec2-user/environment/data/manual_annotations_from_ui.csv')
 quality_data = quality_data.drop('participant_id', axis=1)
 quality_data = quality_data.drop('video_id', axis=1)
 
-# Define a function to calculate the quality score
-def calculate_quality_score(row):
-    if row['action_presence'] == 0:
-        return 0.0  # If action_presence is 0, the quality_score is 0
-
-    quality_dimensions = ['camera_motion', 'lighting', 'focus', 'action_completeness', 'object_presence']
-
-    # Avoid division by zero in case all quality dimensions are zero
-    sum_of_inverses = sum(1.0 / row[dim] for dim in quality_dimensions if row[dim] != 0)
-    
-    if sum_of_inverses == 0:
-        return 0.0  # If all dimensions are zero, return zero score
-
-    # Calculate the harmonic mean of the quality dimensions
-    harmonic_mean = len(quality_dimensions) / sum_of_inverses
-    
-    # Define the min and max values for the harmonic mean
-    HM_min = 1  # The harmonic mean is at least 1 when all dimensions are equal to 1
-    HM_max = 5  # The harmonic mean is at most 5 when all dimensions are equal to 5
-
-    # Normalize the harmonic mean to a value between 0 and 1
-    normalized_score = (harmonic_mean - HM_min) / (HM_max - HM_min)
-    
-    return normalized_score
-
-
-    # Sum the weighted quality dimensions, assume equal weights for simplicity
-    p = 1
-    score = sum(row[dim] ** p for dim in quality_dimensions) / (len(quality_dimensions) ** (p + 1))
-    return score
-
 # Calculate the quality score for each row in the quality data
-quality_data['quality_score'] = quality_data.apply(calculate_quality_score, axis=1)
+quality_data['quality_score'] = harmonic_mean_score(quality_data)
 
 quality_data = quality_data.groupby('narration_id', as_index=False).agg({
     # 'participant_id': 'first',  # You can keep the first occurrence for non-quality_score columns
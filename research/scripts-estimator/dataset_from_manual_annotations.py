@@ -1,20 +1,16 @@
+import os
+import sys
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'augmentation-pipeline'))
+from quality_score import power_mean_score
+
 # Load the CSV files
 quality_data = pd.read_csv('/home/ec2-user/environment/data/manual_annotations_from_ui.csv')
 ground_truth_data = pd.read_csv('/home/ec2-user/environment/data-estimator/manual_annotations_raw_dataset.csv')
 
-# Define a function to calculate the quality score
-def calculate_quality_score(row):
-    if row['action_presence'] == 0:
-        return 0.0  # If action_presence is 0, the quality_score is 0
-    # Sum the weighted quality dimensions, assume equal weights for simplicity
-    quality_dimensions = ['camera_motion', 'lighting', 'focus', 'action_completeness', 'object_presence']
-    score = sum(row[dim] for dim in quality_dimensions) / (5 * len(quality_dimensions))
-    return score
-
 # Calculate the quality score for each row in the quality data
-quality_data['quality_score'] = quality_data.apply(calculate_quality_score, axis=1)
+quality_data['quality_score'] = power_mean_score(quality_data, power=1)
 
 # Merge the quality data with the ground truth data on narration_id
 merged_data = pd.merge(quality_data, ground_truth_data, on='narration_id')